@@ -0,0 +1,540 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import parse_qsl, urlsplit
+import flexpolyline as fp
+import llm
+import tracing
+import transport
+from input import generate_spot_list
+from map import create_distance_matrix, calculate_route_distance, accept_solution, anneal_route, held_karp, haversine
+from map import generate_route, get_travel_time_block, coordinate_cache, address_cache, route_leg_cache, nearby_cache, travel_time_matrix_cache
+from output import create_travel_schedule
+
+# Trip lengths (days) of the pipeline scenarios.
+PIPELINE_DAYS = (1, 3, 7, 30)
+PIPELINE_LOCATION = "台北"
+PIPELINE_PREFERENCE = ["戶外", "自然風景", "朋友"]
+PIPELINE_STAGES = ("generate_spot_list", "generate_route", "create_travel_schedule")
+# One HERE Matrix Routing request and its response, replayed before the pipeline to check the request format.
+MATRIX_SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "here_matrix_sample.json")
+MATRIX_URL = "https://matrix.router.hereapi.com/v8/matrix?async=false"
+# Prefix of the temporary directory holding the caches and schedules of a pipeline run.
+BENCHMARK_DIRECTORY_PREFIX = "trip_benchmark_"
+# Allowed growth of wall time and peak memory over the baseline before it counts as a regression.
+BASELINE_TOLERANCE = 0.25
+
+
+def random_locations(n, seed=0):
+    """Generate `n` random spots inside the bounding box of Taiwan's main island.
+
+    Args:
+        - n (int): The number of spots.
+        - seed (int): The random seed.
+
+    Returns:
+        - list of tuple[str, float, float, str]: The spots in the same format as `generate_spot_list`.
+    """
+    rng = random.Random(seed)
+    return [(f"spot{i}", rng.uniform(22.0, 25.2), rng.uniform(120.2, 121.9), "") for i in range(n)]
+
+
+def legacy_annealing(distance_matrix, route, initial_temperature=1000, cooling_rate=0.995, max_iterations=10000):
+    """The original swap-only annealing that copies the route and recomputes its length every iteration.
+
+    Kept only as the baseline of `benchmark_annealing`.
+    """
+    n = len(distance_matrix)
+    current_route = route[:]
+    current_distance = calculate_route_distance(distance_matrix, current_route)
+    best_route = current_route[:]
+    best_distance = current_distance
+    temperature = initial_temperature
+    for iteration in range(max_iterations):
+        new_route = current_route[:]
+        i, j = random.sample(range(n), 2)
+        new_route[i], new_route[j] = new_route[j], new_route[i]
+        new_distance = calculate_route_distance(distance_matrix, new_route)
+        if accept_solution(current_distance, new_distance, temperature):
+            current_route = new_route
+            current_distance = new_distance
+            if new_distance < best_distance:
+                best_route = new_route
+                best_distance = new_distance
+        temperature *= cooling_rate
+        if temperature < 1e-8:
+            break
+    return best_route, best_distance
+
+
+def annealing_iterations(initial_temperature=1000, cooling_rate=0.995, max_iterations=10000):
+    """Return the number of iterations an annealing run performs before the temperature floor is reached."""
+    return min(max_iterations, math.ceil(math.log(1e-8 / initial_temperature) / math.log(cooling_rate)))
+
+
+def benchmark_annealing(sizes=(15, 60, 300), repeats=3):
+    """Compare the incremental annealing against the legacy implementation.
+
+    Both solvers start from the same shuffled routes and use the same cooling schedule.
+
+    Args:
+        - sizes (tuple of int): The numbers of spots to benchmark.
+        - repeats (int): The number of runs per size; the results are averaged.
+
+    Returns:
+        - list of dict: One row per size and solver with the iterations per second and the average tour length (km).
+    """
+    iterations = annealing_iterations()
+    rows = []
+    for n in sizes:
+        distance_matrix = create_distance_matrix(random_locations(n))
+        nested_matrix = distance_matrix.tolist() if hasattr(distance_matrix, "tolist") else distance_matrix
+        solvers = {
+            "legacy": lambda route, seed: legacy_annealing(nested_matrix, route),
+            "incremental": lambda route, seed: anneal_route(distance_matrix, route, rng=random.Random(seed)),
+        }
+        for name, solver in solvers.items():
+            elapsed = 0.0
+            total_distance = 0.0
+            for seed in range(repeats):
+                route = list(range(n))
+                random.Random(seed).shuffle(route)
+                random.seed(seed)
+                start = time.perf_counter()
+                _, distance = solver(route, seed)
+                elapsed += time.perf_counter() - start
+                total_distance += distance
+            rows.append({
+                "n": n,
+                "solver": name,
+                "iterations_per_second": iterations * repeats / elapsed,
+                "tour_km": total_distance / repeats,
+            })
+    return rows
+
+
+def benchmark_exact(sizes=range(4, 13), repeats=3):
+    """Compare the exact Held-Karp solver against a single annealing run on small trips.
+
+    Args:
+        - sizes (iterable of int): The numbers of spots to benchmark.
+        - repeats (int): The number of random instances per size.
+
+    Returns:
+        - list of dict: One row per size with the average solve time of both solvers (ms)
+            and the average excess length of the annealed tour over the optimum (%).
+    """
+    rows = []
+    for n in sizes:
+        exact_time = annealing_time = gap = 0.0
+        for seed in range(repeats):
+            distance_matrix = create_distance_matrix(random_locations(n, seed))
+            start = time.perf_counter()
+            _, optimum = held_karp(distance_matrix)
+            exact_time += time.perf_counter() - start
+
+            route = list(range(n))
+            random.Random(seed).shuffle(route)
+            start = time.perf_counter()
+            _, distance = anneal_route(distance_matrix, route, rng=random.Random(seed))
+            annealing_time += time.perf_counter() - start
+            gap += (distance - optimum) / optimum * 100 if optimum else 0.0
+        rows.append({
+            "n": n,
+            "held_karp_ms": exact_time / repeats * 1000,
+            "annealing_ms": annealing_time / repeats * 1000,
+            "annealing_gap_percent": gap / repeats,
+        })
+    return rows
+
+
+def stable_random(*parts):
+    """Return a random generator seeded by the content of `parts`, so synthetic responses are reproducible."""
+    return random.Random(hashlib.sha1(repr(parts).encode("utf-8")).hexdigest())
+
+
+def synthetic_http(method, url, params, body):
+    """Answer a Google, HERE or Overpass request with a plausible synthetic response (see `FixtureTransport`).
+
+    Returns:
+        - tuple[int, dict]: The status code and the JSON content.
+    """
+    parts = urlsplit(url)
+    params = dict(params or {}, **dict(parse_qsl(parts.query)))
+    if parts.path.endswith("/geocode/json") and "address" in params:
+        rng = stable_random(params["address"])
+        location = {"lat": rng.uniform(22.0, 25.2), "lng": rng.uniform(120.2, 121.9)}
+        return 200, {"status": "OK", "results": [{"geometry": {"location": location}, "formatted_address": f"臺灣{params['address']}"}]}
+    if parts.path.endswith("/geocode/json"):
+        return 200, {"status": "OK", "results": [{"formatted_address": f"臺灣 {params['latlng']}"}]}
+    if parts.path.endswith("/nearbysearch/json"):
+        lat, lon = map_point(params["location"])
+        rng = stable_random(params["location"], params["radius"])
+        return 200, {"results": [{
+            "name": f"餐廳{rng.randrange(10 ** 6)}",
+            "geometry": {"location": {"lat": lat + rng.uniform(-1, 1) * 0.001, "lng": lon + rng.uniform(-1, 1) * 0.001}},
+            "vicinity": "測試路1號",
+        } for _ in range(5)]}
+    if "overpass" in parts.netloc:
+        elements = []
+        for radius, lat, lon in re.findall(r"around:([\d.]+),([-\d.]+),([-\d.]+)", params.get("data", "")):
+            rng = stable_random(radius, lat, lon)
+            elements += [{"type": "node", "lat": float(lat) + rng.uniform(-1, 1) * 0.001, "lon": float(lon) + rng.uniform(-1, 1) * 0.001,
+                          "tags": {"tourism": "hotel", "name": f"旅館{rng.randrange(10 ** 6)}"}} for _ in range(3)]
+        return 200, {"elements": elements}
+    if parts.path.endswith("/routes"):
+        origin, destination = map_point(params["origin"]), map_point(params["destination"])
+        length = haversine(*origin, *destination) * 1000
+        return 200, {"routes": [{"sections": [{
+            "summary": {"duration": int(length / 30000 * 3600), "length": int(length)},
+            "polyline": fp.encode([origin, destination]),
+        }]}]}
+    if parts.path.endswith("/matrix"):
+        # like the real API: a custom transportMode (flexible mode) needs a bounded region, "world" needs a profile
+        region = body.get("regionDefinition", {}).get("type")
+        if region not in ("circle", "boundingBox", "polygon", "autoCircle", "world") or (region == "world") == ("profile" not in body):
+            return 400, {"title": "Invalid request", "status": 400, "code": "E605001"}
+        origins = [(point["lat"], point["lng"]) for point in body["origins"]]
+        destinations = [(point["lat"], point["lng"]) for point in body["destinations"]]
+        travel_times = [int(haversine(*a, *b) / 30 * 3600) for a in origins for b in destinations]
+        return 200, {"matrix": {"numOrigins": len(origins), "numDestinations": len(destinations), "travelTimes": travel_times}}
+    return 404, {}
+
+
+def map_point(text):
+    lat, lon = text.split(",")
+    return float(lat), float(lon)
+
+
+def synthetic_llm(prompt):
+    """Answer a spot-list, description or brief prompt with a synthetic response."""
+    count = re.search(r"依序輸出 (\d+) 個", prompt)
+    if count:
+        return "\n".join(f"測試景點{i + 1}" for i in range(int(count.group(1))))
+    days = re.search(r"每一天依造訪順序排列的地點：(\[.*?\])\n", prompt)
+    if days:
+        return json.dumps({"days": [{
+            "spots": [{"name": name, "description": f"{name}的測試簡介。"} for name in names],
+            "summary": "測試行程摘要。",
+        } for names in json.loads(days.group(1))]}, ensure_ascii=False)
+    return "簡介：這是一段測試用的簡介。"
+
+
+class LLMFixtures:
+    """Record or replay LLM responses by prompt, mirroring `transport.FixtureTransport`.
+
+    Args:
+        - fixtures (dict): {prompt key: response}.
+        - mode (str): "record" asks the real providers and stores the answers; "replay" only answers from `fixtures`.
+        - latency (float): Seconds added to every replayed response.
+        - fallback (function or None): Called with the prompt for unrecorded prompts in "replay" mode.
+    """
+
+    def __init__(self, fixtures, mode="replay", latency=0.0, fallback=None):
+        self.fixtures = fixtures
+        self.mode = mode
+        self.latency = latency
+        self.fallback = fallback
+        self.router = llm.ProviderRouter(llm.llm_router.providers)
+        self.misses = 0
+
+    async def respond(self, prompt):
+        key = llm.llm_cache_key("fixture", "", prompt)
+        if self.mode == "record":
+            self.fixtures[key] = await self.router.respond(prompt)
+            return self.fixtures[key]
+        await asyncio.sleep(self.latency)
+        if key not in self.fixtures:
+            self.misses += 1
+            if self.fallback is None:
+                raise ValueError("No recorded response for the prompt.")
+            return self.fallback(prompt)
+        return self.fixtures[key]
+
+
+def replay_matrix_sample(path=MATRIX_SAMPLE_PATH, record=False):
+    """Send the sample HERE Matrix Routing request through `get_travel_time_block` and check the parsed travel times.
+
+    The request must match the recorded one exactly, so a change of the request format fails here
+    instead of silently falling back to straight-line estimates. With `record`, the live API answers (API key required)
+    and the sample file is rewritten. It empties the travel time matrix cache, so run it inside `temporary_caches`.
+
+    Args:
+        - path (str): The sample file.
+        - record (bool): Record a new sample instead of replaying it.
+
+    Returns:
+        - list of list: The travel time block (seconds).
+    """
+    with open(path, encoding="utf-8") as file:
+        sample = json.load(file)
+    origins = [tuple(point) for point in sample["origins"]]
+    destinations = [tuple(point) for point in sample["destinations"]]
+    fixtures = dict() if record else {sample["key"]: sample["response"]}
+    matrix_transport = transport.FixtureTransport(fixtures, "record" if record else "replay")
+    previous = transport.set_default_transport(matrix_transport)
+    travel_time_matrix_cache.clear()
+    try:
+        block = get_travel_time_block(origins, destinations, sample["transport_mode"])
+    except transport.FixtureMissing:
+        raise RuntimeError("The HERE Matrix request no longer matches the recorded sample.") from None
+    finally:
+        transport.set_default_transport(previous)
+        travel_time_matrix_cache.clear()
+
+    if record:
+        if block is None:
+            raise RuntimeError("The HERE Matrix request failed, the sample was not recorded.")
+        (sample["key"], sample["response"]), = fixtures.items()
+        sample["expected"] = block
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(sample, file, ensure_ascii=False, indent=2)
+    elif block != sample["expected"]:
+        raise RuntimeError(f"The recorded HERE Matrix response was parsed as {block}, expected {sample['expected']}.")
+    return block
+
+
+# The caches emptied before every pipeline scenario.
+PLANNER_CACHES = (coordinate_cache, address_cache, route_leg_cache, nearby_cache, travel_time_matrix_cache, llm.llm_disk_cache)
+
+
+@contextlib.contextmanager
+def temporary_caches():
+    """Point the planner caches at a file in a new temporary directory, and delete it afterwards.
+
+    The pipeline scenarios empty the caches, so they must never run against the real cache file.
+
+    Yields:
+        - str: The temporary directory.
+    """
+    paths = [planner_cache.path for planner_cache in PLANNER_CACHES]
+    with tempfile.TemporaryDirectory(prefix=BENCHMARK_DIRECTORY_PREFIX) as directory:
+        for planner_cache in PLANNER_CACHES:
+            planner_cache.close()
+            planner_cache.path = os.path.join(directory, "cache.sqlite3")
+        try:
+            yield directory
+        finally:
+            # the connections must be closed before the directory is removed
+            for planner_cache, path in zip(PLANNER_CACHES, paths):
+                planner_cache.close()
+                planner_cache.path = path
+
+
+def clear_caches():
+    """Empty the geocoding, routing, nearby-search and LLM caches so every scenario starts cold."""
+    if not all(os.path.basename(os.path.dirname(planner_cache.path)).startswith(BENCHMARK_DIRECTORY_PREFIX)
+               for planner_cache in PLANNER_CACHES):
+        raise RuntimeError("The caches are not temporary, refusing to clear the real cache (see temporary_caches).")
+    for planner_cache in PLANNER_CACHES:
+        planner_cache.clear()
+    llm.llm_memory_cache.clear()
+
+
+def measure_stage(function, trace_memory=False):
+    """Run one pipeline stage with tracing, measuring either its wall time or its peak memory.
+
+    tracemalloc slows Python code down several times over, so wall time is only measured without it.
+
+    Args:
+        - function (function): The stage.
+        - trace_memory (bool): Measure the peak memory with tracemalloc instead of the wall time.
+
+    Returns:
+        - tuple: (the stage's return value, {"wall_ms" or "peak_kb", "http_requests", "llm_requests"}).
+    """
+    tracing.reset()
+    tracing.enable()
+    if trace_memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        # the pipeline prints progress and displays tables, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function()
+    finally:
+        wall = time.perf_counter() - start
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        tracing.disable()
+    counters = tracing.counters()
+    measurements = {"peak_kb": peak / 1024} if trace_memory else {"wall_ms": wall * 1000}
+    measurements["http_requests"] = dict(counters.get("http.requests", {}))
+    measurements["llm_requests"] = sum(counters.get("llm.provider_requests", {}).values())
+    return result, measurements
+
+
+def run_scenario(days, seed=0, trace_memory=False):
+    """Plan a trip of `days` days through the whole pipeline and measure every stage.
+
+    Args:
+        - days (int): The trip length.
+        - seed (int): The random seed.
+        - trace_memory (bool): Measure peak memory instead of wall time, see `measure_stage`.
+
+    Returns:
+        - dict: {stage: measurements}, see `measure_stage`.
+    """
+    clear_caches()
+    random.seed(seed)
+    stages = dict()
+    spots, stages["generate_spot_list"] = measure_stage(
+        lambda: generate_spot_list(PIPELINE_LOCATION, days, PIPELINE_PREFERENCE), trace_memory)
+    (_, grouped_locations, travel_times), stages["generate_route"] = measure_stage(lambda: generate_route(spots), trace_memory)
+    _, stages["create_travel_schedule"] = measure_stage(
+        lambda: [create_travel_schedule(group, times) for group, times in zip(grouped_locations, travel_times)], trace_memory)
+    return stages
+
+
+def benchmark_pipeline(fixtures_path=None, record=False, latency=0.05, days=PIPELINE_DAYS):
+    """Benchmark `generate_spot_list` → `generate_route` → `create_travel_schedule` without network access.
+
+    HTTP requests go through a `transport.FixtureTransport` and LLM prompts through `LLMFixtures`. Requests missing
+    from the fixtures (or every request, without a fixture file) get synthetic responses, counted as misses.
+    Caches start empty in every scenario (they use a temporary file, see `temporary_caches`) and the schedules are
+    written to the same temporary directory. Each scenario runs twice: once for wall time and once, replayed, for peak memory.
+    The recorded HERE Matrix sample is replayed first, see `replay_matrix_sample`.
+
+    Args:
+        - fixtures_path (str or None): The fixture JSON file to replay, or to write when `record` is True.
+        - record (bool): Send real requests (API keys required) and record them to `fixtures_path`.
+        - latency (float): Seconds added to every replayed HTTP or LLM response.
+        - days (iterable of int): The trip lengths to run.
+
+    Returns:
+        - dict: {days: {stage: measurements}}, plus "fixture_misses" per scenario.
+    """
+    fixtures = {"http": {}, "llm": {}}
+    if fixtures_path and not record:
+        with open(fixtures_path, encoding="utf-8") as file:
+            fixtures = json.load(file)
+
+    mode = "record" if record else "replay"
+    http = transport.FixtureTransport(fixtures["http"], mode, latency, fallback=synthetic_http)
+    llm_fixtures = LLMFixtures(fixtures["llm"], mode, latency, fallback=synthetic_llm)
+    previous_transport = transport.set_default_transport(http)
+    previous_router, llm.llm_router = llm.llm_router, llm.ProviderRouter([("fixture", llm_fixtures.respond)])
+    cwd = os.getcwd()
+    results = dict()
+    try:
+        with temporary_caches() as directory:
+            os.chdir(directory)
+            replay_matrix_sample(record=record)
+            for n in days:
+                http.mode, llm_fixtures.mode = mode, mode
+                misses = http.misses + llm_fixtures.misses
+                results[str(n)] = run_scenario(n)
+                results[str(n)]["fixture_misses"] = http.misses + llm_fixtures.misses - misses
+                # the same scenario again for peak memory, replaying what was just recorded
+                http.mode, llm_fixtures.mode = "replay", "replay"
+                memory = run_scenario(n, trace_memory=True)
+                for stage in PIPELINE_STAGES:
+                    results[str(n)][stage]["peak_kb"] = memory[stage]["peak_kb"]
+    finally:
+        os.chdir(cwd)
+        transport.set_default_transport(previous_transport)
+        llm.llm_router = previous_router
+
+    if record:
+        with open(fixtures_path, "w", encoding="utf-8") as file:
+            json.dump(fixtures, file, ensure_ascii=False)
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=BASELINE_TOLERANCE):
+    """Compare pipeline results with a baseline from an earlier `benchmark_pipeline` run.
+
+    Any increase in request counts is a regression; wall time and peak memory may grow by `tolerance`.
+
+    Returns:
+        - list of str: The regressions found.
+    """
+    regressions = []
+    for days, stages in results.items():
+        for stage in PIPELINE_STAGES:
+            current, expected = stages.get(stage), baseline.get(days, {}).get(stage)
+            if current is None or expected is None:
+                continue
+            name = f"{days} 天 {stage}"
+            for provider, count in current["http_requests"].items():
+                if count > expected["http_requests"].get(provider, 0):
+                    regressions.append(f"{name}: {provider} 請求數 {expected['http_requests'].get(provider, 0)} → {count}")
+            if current["llm_requests"] > expected["llm_requests"]:
+                regressions.append(f"{name}: LLM 請求數 {expected['llm_requests']} → {current['llm_requests']}")
+            for metric in ("wall_ms", "peak_kb"):
+                if current[metric] > expected[metric] * (1 + tolerance):
+                    regressions.append(f"{name}: {metric} {expected[metric]:.1f} → {current[metric]:.1f}")
+    return regressions
+
+
+def pipeline_rows(results):
+    """Flatten `benchmark_pipeline` results into table rows."""
+    return [{
+        "days": int(days),
+        "stage": stage,
+        "wall_ms": stages[stage]["wall_ms"],
+        "peak_kb": stages[stage]["peak_kb"],
+        "http_requests": sum(stages[stage]["http_requests"].values()),
+        "llm_requests": stages[stage]["llm_requests"],
+    } for days, stages in results.items() for stage in PIPELINE_STAGES]
+
+
+def print_rows(rows):
+    """Print benchmark rows as an aligned table."""
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[f"{row[column]:.1f}" if isinstance(row[column], float) else str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(cell[i]) for cell in cells)) for i, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for cell in cells:
+        print("  ".join(value.rjust(width) for value, width in zip(cell, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trip planner benchmarks")
+    parser.add_argument("suite", nargs="?", choices=["solver", "pipeline"], default="solver")
+    parser.add_argument("--fixtures", help="fixture file to replay (or to write with --record)")
+    parser.add_argument("--record", action="store_true", help="record fixtures from the live APIs")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every replayed response")
+    parser.add_argument("--days", type=int, nargs="+", default=list(PIPELINE_DAYS))
+    parser.add_argument("--baseline", help="baseline file to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to the baseline file")
+    args = parser.parse_args()
+
+    if args.suite == "solver":
+        print_rows(benchmark_annealing())
+        print()
+        print_rows(benchmark_exact())
+        sys.exit()
+
+    if args.record and not args.fixtures:
+        parser.error("--record requires --fixtures")
+    results = benchmark_pipeline(args.fixtures, args.record, args.latency, args.days)
+    print_rows(pipeline_rows(results))
+    misses = {days: stages["fixture_misses"] for days, stages in results.items() if stages["fixture_misses"]}
+    if misses and args.fixtures and not args.record:
+        print(f"未錄製而改用合成回應的請求數：{misses}")
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    elif args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare_with_baseline(results, json.load(file))
+        for regression in regressions:
+            print(f"效能退步：{regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import tracing
+
+# 快取檔案位置（可由環境變數 TRIP_CACHE_PATH 覆寫）
+CACHE_PATH = os.environ.get("TRIP_CACHE_PATH", "trip_cache.sqlite3")
+
+# 超過容量時一次淘汰的比例，淘汰後保留空間，不必每次寫入都計算項目數
+EVICTION_FRACTION = 0.1
+
+# 代表快取未命中，以便與快取中存放的 False / None 等值區分
+MISSING = object()
+
+
+class SQLiteCache:
+    """Disk-backed key-value cache with TTL, LRU eviction and hit/miss counters.
+
+    Entries of every cache share one SQLite file and are separated by `namespace`, so the
+    geocoding, routing and LLM caches can live side by side. Values must be JSON serializable.
+
+    Args:
+        - namespace (str): The name used to separate this cache from the others in the same file.
+        - ttl (float or None): Seconds before an entry expires. None means entries never expire.
+        - max_entries (int or None): The maximum number of entries kept in this namespace.
+            The least recently used entries are evicted first, `EVICTION_FRACTION` of them at a time. None means no limit.
+        - path (str or None): The SQLite file path. Defaults to `CACHE_PATH`.
+    """
+
+    def __init__(self, namespace, ttl=None, max_entries=None, path=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path or CACHE_PATH
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        # 項目數的估計值（取代覆寫的項目也會計入），超過 max_entries 時才重新計算並淘汰
+        self._size = None
+
+    def _connect(self):
+        # 延遲建立連線，未使用快取時不會產生檔案
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key, default=MISSING):
+        """Return the cached value of `key`, or `default` if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                    conn.commit()
+                    if self._size is not None:
+                        self._size -= 1
+                self.misses += 1
+                tracing.count("cache.misses", provider=self.namespace)
+                return default
+            conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            conn.commit()
+            self.hits += 1
+        tracing.count("cache.hits", provider=self.namespace)
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=MISSING):
+        """Store `value` under `key`. `ttl` overrides the cache-wide TTL for this entry."""
+        now = time.time()
+        ttl = self.ttl if ttl is MISSING else ttl
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            if self.max_entries is not None:
+                self._size = self._count(conn) if self._size is None else self._size + 1
+                if self._size > self.max_entries:
+                    self._evict(conn)
+            conn.commit()
+
+    def _count(self, conn):
+        return conn.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+    def _evict(self, conn):
+        # 超過容量時一次淘汰最久未使用的項目，降到容量的 (1 - EVICTION_FRACTION)
+        size = self._count(conn)
+        target = self.max_entries - int(self.max_entries * EVICTION_FRACTION)
+        if size > target:
+            conn.execute(
+                """DELETE FROM cache WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache WHERE namespace = ?
+                    ORDER BY accessed_at ASC LIMIT ?
+                )""",
+                (self.namespace, self.namespace, size - target),
+            )
+            size = target
+        self._size = size
+
+    def close(self):
+        """Close the SQLite connection; it is opened again on next use."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._size = None
+
+    def clear(self):
+        """Remove every entry of this namespace and reset the counters."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+            conn.commit()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the hit/miss counters and the current number of entries."""
+        with self._lock:
+            size = self._connect().execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "size": size}
@@ -0,0 +1,143 @@
+import json
+import sys
+from functools import lru_cache
+try:
+    import numpy as np
+except ImportError:  # 未安裝 numpy 時無法使用離線索引，改用 Nominatim
+    np = None
+
+
+def build_county_index(geojson_path, output_path, county_property="COUNTYENG", town_property="TOWNENG"):
+    """Build the offline county/township index from a GeoJSON file of Taiwan administrative boundaries.
+
+    Each feature is one township (or one county if `town_property` is missing) as a Polygon or MultiPolygon,
+    e.g. the township boundaries published on the government open data platform converted to GeoJSON.
+    The index is stored as a compressed `.npz` file with float32 vertices, ring offsets and per-feature bounding boxes.
+
+    Args:
+        - geojson_path (str): The GeoJSON FeatureCollection.
+        - output_path (str): The `.npz` file to write.
+        - county_property (str): The feature property holding the county name.
+        - town_property (str): The feature property holding the township name.
+
+    Returns:
+        - int: The number of indexed features.
+    """
+    with open(geojson_path, encoding="utf-8") as file:
+        features = json.load(file)["features"]
+
+    vertices, ring_offsets, ring_features, bboxes, counties, towns = [], [0], [], [], [], []
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            continue
+
+        feature_id = len(counties)
+        points = []
+        for polygon in polygons:
+            # 外環與內環（洞）一起以奇偶規則判斷，不需區分
+            for ring in polygon:
+                vertices.extend((lon, lat) for lon, lat, *_ in ring)
+                points.extend(ring)
+                ring_offsets.append(len(vertices))
+                ring_features.append(feature_id)
+        lons = [point[0] for point in points]
+        lats = [point[1] for point in points]
+        bboxes.append((min(lons), min(lats), max(lons), max(lats)))
+        properties = feature.get("properties") or {}
+        counties.append(properties.get(county_property, ""))
+        towns.append(properties.get(town_property, ""))
+
+    np.savez_compressed(
+        output_path,
+        vertices=np.array(vertices, dtype=np.float32).reshape(-1, 2),
+        ring_offsets=np.array(ring_offsets, dtype=np.int64),
+        ring_features=np.array(ring_features, dtype=np.int32),
+        bboxes=np.array(bboxes, dtype=np.float64).reshape(-1, 4),
+        counties=np.array(counties, dtype=str),
+        towns=np.array(towns, dtype=str),
+    )
+    return len(counties)
+
+
+class CountyIndex:
+    """Point-in-polygon index over county and township boundaries.
+
+    Args:
+        - path (str): The `.npz` file written by `build_county_index`.
+    """
+
+    def __init__(self, path):
+        data = np.load(path)
+        vertices = data["vertices"].astype(np.float64)
+        ring_offsets = data["ring_offsets"]
+        ring_features = data["ring_features"]
+        self.bboxes = data["bboxes"]
+        self.counties = data["counties"]
+        self.towns = data["towns"]
+
+        # 預先展開每個區域的邊 (x1, y1, x2, y2)，不跨越不同的環
+        edge_lists = [[] for _ in range(len(self.bboxes))]
+        for ring, feature_id in enumerate(ring_features):
+            start, end = ring_offsets[ring], ring_offsets[ring + 1]
+            if end - start >= 2:
+                edge_lists[feature_id].append(np.hstack([vertices[start:end - 1], vertices[start + 1:end]]))
+        self.edges = [np.vstack(edges) if edges else np.empty((0, 4)) for edges in edge_lists]
+
+    def lookup_many(self, lats, lons):
+        """Return the indices of the features containing each point, or -1 outside coverage.
+
+        Args:
+            - lats (array-like of float), lons (array-like of float): The points to look up.
+
+        Returns:
+            - numpy.ndarray of int: The feature index per point.
+        """
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        result = np.full(len(lats), -1, dtype=np.int64)
+        # 一次比較所有點與所有區域的外接矩形（點數 × 區域數），只對外接矩形包含點的區域做射線法判斷
+        lon_min, lat_min, lon_max, lat_max = self.bboxes.T
+        in_bbox = ((lats[:, None] >= lat_min) & (lats[:, None] <= lat_max)
+                   & (lons[:, None] >= lon_min) & (lons[:, None] <= lon_max))
+        for feature_id in np.nonzero(in_bbox.any(axis=0))[0]:
+            candidates = np.nonzero(in_bbox[:, feature_id] & (result < 0))[0]
+            if not len(candidates):
+                continue
+            x1, y1, x2, y2 = self.edges[feature_id].T
+            px = lons[candidates, None]
+            py = lats[candidates, None]
+            crosses = (y1 > py) != (y2 > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_intersect = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            inside = np.count_nonzero(crosses & (px < x_intersect), axis=1) % 2 == 1
+            result[candidates[inside]] = feature_id
+        return result
+
+    def lookup(self, lat, lon):
+        """Return (county, township) of the point, or None outside coverage."""
+        feature_id = int(self.lookup_many([lat], [lon])[0])
+        if feature_id < 0:
+            return None
+        return str(self.counties[feature_id]), str(self.towns[feature_id])
+
+
+@lru_cache(maxsize=4)
+def load_county_index(path):
+    """Load (once per path) the county index, or return None if it has not been built or numpy is missing."""
+    if np is None:
+        return None
+    try:
+        return CountyIndex(path)
+    except FileNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    # python county_index.py taiwan_towns.geojson taiwan_counties.npz
+    count = build_county_index(sys.argv[1], sys.argv[2])
+    print(f"已建立 {count} 個行政區的索引：{sys.argv[2]}")
@@ -0,0 +1,182 @@
+import csv
+import json
+import os
+import sys
+import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+try:
+    from opencc import OpenCC
+    _to_traditional = OpenCC("s2t").convert
+except ImportError:  # 未安裝 opencc 時以常見地名用字對照表轉換
+    _to_traditional = None
+from poi_index import format_osm_address
+
+# 景點名錄 CSV（欄位：name, aliases, lat, lon, address；aliases 以「|」分隔）
+GAZETTEER_PATH = os.environ.get("TRIP_GAZETTEER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "taiwan_attractions.csv"))
+
+# 前綴比對的最短長度（正規化後的字數），以及查詢佔比對到名稱長度的最低比例，
+# 避免「故」、「台北」這類過短的名稱對應到唯一的景點
+PREFIX_MIN_LENGTH = 4
+PREFIX_MIN_COVERAGE = 0.6
+
+# 匯出台灣景點用的 Overpass 查詢，結果存成 JSON 後交給 build_gazetteer
+OVERPASS_EXPORT_QUERY = """
+[out:json][timeout:900];
+area["ISO3166-1"="TW"][admin_level=2]->.tw;
+(
+  nwr["tourism"~"^(attraction|museum|viewpoint|theme_park|zoo|aquarium|gallery)$"]["name"](area.tw);
+  nwr["historic"]["name"](area.tw);
+  nwr["leisure"~"^(park|nature_reserve)$"]["name"](area.tw);
+);
+out center tags;
+"""
+
+# 作為別名的 OSM 名稱標籤
+ALIAS_TAGS = ("name:zh", "name:zh-Hant", "name:en", "alt_name", "official_name", "short_name", "old_name")
+
+# 地名常見的簡體字與對應的繁體字
+SIMPLIFIED_TO_TRADITIONAL = str.maketrans(
+    "湾园馆纪龙门东车庙桥乐场艺术历观厅区县乡镇楼国际华义兰绿岛滩温风游览动阳钟鸟鱼农渔书图电会发庄宁丰凤头贝汤荣宝寿宫",
+    "灣園館紀龍門東車廟橋樂場藝術歷觀廳區縣鄉鎮樓國際華義蘭綠島灘溫風遊覽動陽鐘鳥魚農漁書圖電會發莊寧豐鳳頭貝湯榮寶壽宮",
+)
+
+
+def normalize_place_name(name):
+    """Normalize a place name for lookup.
+
+    Full-width characters become half-width, simplified Chinese becomes traditional, 臺 becomes 台,
+    and whitespace and letter case are ignored, so 「台北１０１」, 「臺北 101」 and 「台北101」 share one key.
+
+    Args:
+        - name (str): The place name.
+
+    Returns:
+        - str: The normalized key.
+    """
+    name = unicodedata.normalize("NFKC", name)
+    name = _to_traditional(name) if _to_traditional is not None else name.translate(SIMPLIFIED_TO_TRADITIONAL)
+    return "".join(name.split()).replace("臺", "台").lower()
+
+
+class Gazetteer:
+    """Sorted-array index over attraction names and aliases, supporting exact and prefix lookups.
+
+    Args:
+        - path (str): The gazetteer CSV file.
+    """
+
+    def __init__(self, path):
+        self.entries = []
+        keys = {}
+        with open(path, encoding="utf-8-sig", newline="") as file:
+            for row in csv.DictReader(file):
+                entry_id = len(self.entries)
+                self.entries.append((row["name"], float(row["lat"]), float(row["lon"]), row.get("address", "")))
+                for name in [row["name"], *(row.get("aliases") or "").split("|")]:
+                    if name.strip():
+                        keys.setdefault(normalize_place_name(name), entry_id)
+        # 以排序後的鍵陣列取代字典樹，二分搜尋即可同時支援完全比對與前綴比對
+        self.keys = sorted(keys)
+        self.ids = [keys[key] for key in self.keys]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def exact(self, name):
+        """Return the entry (name, lat, lon, address) whose normalized name or alias equals `name`, or None."""
+        key = normalize_place_name(name)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.entries[self.ids[i]]
+        return None
+
+    def prefix(self, name, limit=10):
+        """Return up to `limit` distinct entries whose normalized name or alias starts with `name`."""
+        key = normalize_place_name(name)
+        found = []
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i].startswith(key) and len(found) < limit:
+            if self.ids[i] not in found:
+                found.append(self.ids[i])
+            i += 1
+        return [self.entries[entry_id] for entry_id in found]
+
+    def lookup(self, name):
+        """Return the entry matching `name` exactly, or the only entry it is a long enough prefix of; otherwise None.
+
+        A prefix match needs at least `PREFIX_MIN_LENGTH` characters and `PREFIX_MIN_COVERAGE` of the matched name.
+        """
+        key = normalize_place_name(name)
+        if not key:
+            return None
+        entry = self.exact(name)
+        if entry is not None:
+            return entry
+        if len(key) < PREFIX_MIN_LENGTH:
+            return None
+        # 前綴比對只接受唯一結果，且查詢須涵蓋名稱的大部分，避免「台北」這類名稱對應到錯誤的景點
+        i = bisect_left(self.keys, key)
+        matches = dict()
+        while i < len(self.keys) and self.keys[i].startswith(key) and len(matches) < 2:
+            matches.setdefault(self.ids[i], self.keys[i])
+            i += 1
+        if len(matches) != 1:
+            return None
+        entry_id, matched = matches.popitem()
+        return self.entries[entry_id] if len(key) / len(matched) >= PREFIX_MIN_COVERAGE else None
+
+
+def build_gazetteer(source_path, output_path):
+    """Build the gazetteer CSV from an Overpass JSON export (see `OVERPASS_EXPORT_QUERY`).
+
+    Other OSM names of a place (`ALIAS_TAGS`, `;`-separated values included) become its aliases.
+
+    Args:
+        - source_path (str): The Overpass JSON export.
+        - output_path (str): The gazetteer CSV file.
+
+    Returns:
+        - int: The number of places written.
+    """
+    with open(source_path, encoding="utf-8") as file:
+        elements = json.load(file).get("elements", [])
+
+    rows, seen = [], set()
+    for element in elements:
+        tags = element.get("tags", {})
+        name = tags.get("name")
+        lat = element.get("lat", element.get("center", {}).get("lat"))
+        lon = element.get("lon", element.get("center", {}).get("lon"))
+        if not name or lat is None or lon is None or normalize_place_name(name) in seen:
+            continue
+        seen.add(normalize_place_name(name))
+        aliases = []
+        for tag in ALIAS_TAGS:
+            for alias in tags.get(tag, "").split(";"):
+                alias = alias.strip()
+                if alias and alias != name and alias not in aliases:
+                    aliases.append(alias)
+        rows.append({"name": name, "aliases": "|".join(aliases), "lat": lat, "lon": lon, "address": format_osm_address(tags)})
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["name", "aliases", "lat", "lon", "address"])
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
+@lru_cache(maxsize=4)
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Load (once per path) the gazetteer, or return None if the file does not exist."""
+    try:
+        return Gazetteer(path)
+    except FileNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    # python gazetteer.py taiwan_attractions_export.json data/taiwan_attractions.csv
+    count = build_gazetteer(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else GAZETTEER_PATH)
+    print(f"已建立 {count} 個景點的名錄：{sys.argv[2] if len(sys.argv) > 2 else GAZETTEER_PATH}")
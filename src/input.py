@@ -1,9 +1,15 @@
 from datetime import datetime
-from llm import duckchat_response
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from llm import routed_response, taiwan_llm_stream, iter_lines
 from map import get_coordinate
+import tracing
 import ipywidgets as widgets
 from IPython.display import display
 
+# The maximum number of spot names geocoded at the same time.
+GEOCODE_CONCURRENCY = 8
+
 def validate_date_input(start_date_input: str, end_date_input: str) -> int:
     """Validate the date input and calculate the number of days between the two dates.
 
@@ -38,7 +44,46 @@ def validate_date_input(start_date_input: str, end_date_input: str) -> int:
     # calculate the number of days between the two dates (end date included)
     return (end_date - start_date).days + 1
 
-def generate_spot_list(location: str, days: int, preference: list[str]) -> list[tuple[str, float, float, str]]:
+def collect_spots(spot_names, num_spots: int, executor: ThreadPoolExecutor) -> list[tuple[str, float, float, str]]:
+    """Geocode spot names concurrently and keep the first valid ones in the given order.
+
+    `spot_names` may be a generator that is still being streamed from the LLM. Each name is geocoded
+    as soon as it arrives, and the generator is closed once `num_spots` valid spots are collected.
+
+    Args:
+        - spot_names (iterable of str): The spot names in the order suggested by the LLM.
+        - num_spots (int): The maximum number of spots to collect.
+        - executor (ThreadPoolExecutor): The executor running `get_coordinate`.
+
+    Returns:
+        - list of tuple[str, float, float, str]: At most `num_spots` geocoded spots, in the order of `spot_names`.
+    """
+    spot_list = list()
+    pending = deque()
+
+    def take_results(wait):
+        # consume finished lookups from the front only, so the LLM output order is kept
+        while pending and len(spot_list) < num_spots and (wait or pending[0].done()):
+            spot_info = pending.popleft().result()
+            if spot_info:
+                spot_list.append(spot_info)
+
+    for spot_name in spot_names:
+        pending.append(executor.submit(tracing.propagate(get_coordinate), spot_name))
+        take_results(wait = False)
+        if len(spot_list) >= num_spots:
+            break
+    take_results(wait = True)
+
+    # enough spots are collected, stop the stream and drop the lookups that have not started yet
+    if hasattr(spot_names, "close"):
+        spot_names.close()
+    for future in pending:
+        future.cancel()
+    return spot_list
+
+@tracing.traced()
+def generate_spot_list(location: str, days: int, preference: list[str], max_workers: int = GEOCODE_CONCURRENCY, stream: bool = False) -> list[tuple[str, float, float, str]]:
     """Generate a list of spots for a trip to a specific location for a certain number of days.
     
     Args:
@@ -48,6 +93,9 @@ def generate_spot_list(location: str, days: int, preference: list[str]) -> list[
             - `preference[0]`: venue_type (戶外活動, 室內行程, 不限)
             - `preference[1]`: attraction_theme (自然風景, 人文藝術, 購物娛樂, 不限)
             - `preference[2]`: travel_with (一人旅遊, 情侶同行, 好友出遊, 家庭旅行, 不限)
+        - max_workers (int): The maximum number of spot names geocoded concurrently.
+        - stream (bool): If True, stream the spot names from the Taiwan LLM model and geocode each one as soon as its line is complete.
+            The stream is stopped as soon as enough spots are collected.
     Returns:
         - list of tuple[str, float, float, str]: A list of spots for the trip. Each spot is represented by a tuple(spot name, latitude, longitude, address).
     """
@@ -55,6 +103,7 @@ def generate_spot_list(location: str, days: int, preference: list[str]) -> list[
     # call Taiwan LLM API
     num_spots = 3 * days
     spot_list = list()
+    executor = ThreadPoolExecutor(max_workers = max_workers)
 
     # if the response is not enough, keep asking for more spots
     while len(spot_list) < num_spots:
@@ -74,16 +123,15 @@ def generate_spot_list(location: str, days: int, preference: list[str]) -> list[
             - 景點類型盡量不重複，例如不要同時有 2 個美術館
             請據此篩選景點，並確保推薦結果符合場地類型、活動特性、景點主題與地理位置的設定"""
         
-        response = duckchat_response(prompt)
-        # remove empty spots and add to the spot_list
-        spot_names = [spot for spot in response.split("\n") if spot.strip()]
-        for spot_name in spot_names:
-            # get the coordinates of the spot
-            spot_info = get_coordinate(spot_name)
-            if spot_info:
-                spot_list.append(spot_info)
-            if len(spot_list) >= num_spots:
-                break
+        if stream:
+            spot_names = iter_lines(taiwan_llm_stream(prompt))
+        else:
+            response = routed_response(prompt)
+            # remove empty spots and add to the spot_list
+            spot_names = [spot for spot in response.split("\n") if spot.strip()]
+        # get the coordinates of the spots concurrently, keeping the LLM output order
+        spot_list.extend(collect_spots(spot_names, num_spots - len(spot_list), executor))
+    executor.shutdown(wait = False, cancel_futures = True)
     
     # num_spots spots are collected
     return spot_list
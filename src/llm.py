@@ -1,8 +1,156 @@
 from duck_chat import DuckChat
-from openai import OpenAI, APITimeoutError
+from openai import OpenAI, AsyncOpenAI, APITimeoutError
+import aiohttp
 import asyncio
-import nest_asyncio
-nest_asyncio.apply()
+import atexit
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from cache import SQLiteCache, MISSING
+import tracing
+
+# Models used by each provider, also part of the response cache key.
+DUCKCHAT_MODEL = "default"
+TAIWAN_LLM_MODEL = "yentinglin/llama-3-taiwan-70b-instruct"
+CHATGPT_MODEL = "gpt-4o-mini"
+TAIWAN_LLM_BASE_URL = "https://integrate.api.nvidia.com/v1"
+SYSTEM_PROMPT = "你是一個優秀的繁體中文助理，會提供符合使用者需求的回應。"
+
+# Headers of the shared DuckChat HTTP session, the same ones DuckChat sets on a session it creates itself.
+DUCKCHAT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+DUCKCHAT_HEADERS = {
+    "Host": "duckduckgo.com",
+    "Accept": "text/event-stream",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Referer": "https://duckduckgo.com/",
+    "User-Agent": DUCKCHAT_USER_AGENT,
+    "DNT": "1",
+    "Sec-GPC": "1",
+    "Connection": "keep-alive",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-origin",
+    "TE": "trailers",
+}
+
+# Maximum number of concurrent requests sent by `gather_responses`.
+LLM_CONCURRENCY = 8
+
+# Provider router settings: a hedged request is sent once the current provider exceeds its p95 latency
+# (or the default delay before enough samples exist), and a provider failing repeatedly is skipped for a while.
+ROUTER_HEDGE_DELAY = 10.0
+ROUTER_MIN_SAMPLES = 5
+ROUTER_WINDOW = 100
+ROUTER_FAILURE_THRESHOLD = 3
+ROUTER_COOLDOWN = 60.0
+
+# Response cache settings: an in-process LRU tier in front of the on-disk tier.
+LLM_CACHE_TTL = 30 * 24 * 3600
+LLM_MEMORY_CACHE_SIZE = 256
+LLM_DISK_CACHE_MAX_ENTRIES = 20000
+
+# All LLM requests run on one long-lived background event loop, so clients and their connection pools
+# are created once and reused by every call instead of a new session and event loop per call.
+llm_event_loop = None
+llm_event_loop_thread = None
+llm_clients = dict()
+llm_client_lock = threading.Lock()
+
+def get_event_loop():
+    """Return the background event loop running all LLM requests, starting it on first use."""
+    global llm_event_loop, llm_event_loop_thread
+    with llm_client_lock:
+        if llm_event_loop is None:
+            llm_event_loop = asyncio.new_event_loop()
+            llm_event_loop_thread = threading.Thread(target = llm_event_loop.run_forever, name = "llm-event-loop", daemon = True)
+            llm_event_loop_thread.start()
+        return llm_event_loop
+
+def run_sync(coroutine):
+    """Run a coroutine on the background event loop and wait for its result.
+
+    Works the same in scripts and inside an already running event loop (e.g. Jupyter).
+
+    Args:
+        - coroutine (coroutine): The coroutine to run, e.g. `duckchat_response_async(prompt)`.
+
+    Returns:
+        - The result of the coroutine.
+    """
+    loop = get_event_loop()
+    if threading.current_thread() is llm_event_loop_thread:
+        coroutine.close()
+        raise RuntimeError("run_sync cannot be called from the LLM event loop, await the coroutine instead.")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+def get_client(client_class, **settings):
+    """Return the shared client of `client_class` (`OpenAI` or `AsyncOpenAI`) for the settings, creating it on first use."""
+    key = (client_class.__name__, tuple(sorted(settings.items())))
+    with llm_client_lock:
+        if key not in llm_clients:
+            llm_clients[key] = client_class(**settings)
+        return llm_clients[key]
+
+def new_duckchat():
+    """Return a new DuckChat conversation on the shared HTTP session. Must be called on the LLM event loop.
+
+    Each prompt needs its own conversation (history and token), but the session and its connections are reused.
+    The session is owned by this module and closed by `close_clients`.
+    """
+    session = llm_clients.get("duckchat")
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(headers = DUCKCHAT_HEADERS)
+        llm_clients["duckchat"] = session
+    return DuckChat(session = session, user_agent = DUCKCHAT_USER_AGENT)
+
+async def close_clients_async():
+    """Asynchronous version of `close_clients`."""
+    with llm_client_lock:
+        clients = list(llm_clients.values())
+        llm_clients.clear()
+    for client in clients:
+        result = client.close()
+        if asyncio.iscoroutine(result):
+            await result
+
+def close_clients():
+    """Close the shared DuckChat session and API clients with their connections; they are created again on next use.
+
+    Called automatically at interpreter exit.
+    """
+    if llm_event_loop is None or not llm_clients:
+        return
+    run_sync(close_clients_async())
+
+atexit.register(close_clients)
+
+def format_messages(prompt):
+    """Return the messages list for a prompt, see `taiwan_llm_response` for the accepted formats."""
+    if isinstance(prompt, str) and prompt.strip():
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    elif isinstance(prompt, list) and len(prompt) > 0 and all(isinstance(item, dict) and "role" in item and item["role"] in ["user", "system", "assistant"] and "content" in item and item["content"].strip() for item in prompt):
+        return prompt
+    else:
+        raise ValueError("Prompt must be a non-empty string or a list.")
+
+async def duckchat_response_async(prompt):
+    """Asynchronous version of `duckchat_response`."""
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("Prompt must be a non-empty string.")
+
+    chat = new_duckchat()
+    response = await chat.ask_question(prompt)
+    if response is not None:
+        return response
+    else:
+        raise ValueError("No response from the model.")
 
 def duckchat_response(prompt):
     """Generate response from DuckChat AI Chatbot.
@@ -13,18 +161,7 @@ def duckchat_response(prompt):
     Returns:
         - str: The response generated by the model.
     """
-    if not isinstance(prompt, str) or not prompt.strip():
-        raise ValueError("Prompt must be a non-empty string.")
-    
-    async def get_response():
-        async with DuckChat() as chat:
-            response = await chat.ask_question(prompt)
-            if response is not None:
-                return response
-            else:
-                raise ValueError("No response from the model.")
-
-    return asyncio.run(get_response())
+    return run_sync(duckchat_response_async(prompt))
 
 # TODO: Please add your API key for the model you want to use below.
 # If you don't want to pay, you can use the Taiwan LLM model for free, but the response is not guaranteed.
@@ -33,47 +170,31 @@ taiwan_llm_api_key = ""
 # If you have paid for the ChatGPT API key, you can use the ChatGPT model.
 chatgpt_api_key = ""
 
-# If you want to use the Taiwan LLM model, test the chat UI at it's website.
-# https://build.nvidia.com/yentinglin/llama-3-taiwan-70b-instruct
-# If it keeps showing "You are XXX in line", then the API key is not available now, please wait for a while.
-# If the response is available, then you can use the API key to call the model.
-def taiwan_llm_response(prompt):
-    """Generate response from Taiwan LLM model.
+def taiwan_llm_stream(prompt):
+    """Stream response chunks from Taiwan LLM model as they are generated.
+
+    Closing the generator early closes the underlying HTTP stream, so no more tokens are generated.
 
     Args:
         - prompt (str or list of dict): The user's input prompt / the messages list to generate response.
-            For the list of dictionaries type, each dictionary should be in the form {"role": "user/system/assistant", "content": "(message)"}.
-            - "role" = "user" for user input
-            - "role" = "system" for the initial setting of the assistant
-            - "role" = "assistant" for the assistant's response.
+            See `taiwan_llm_response` for the format of the messages list.
 
-    Returns:
-        - str: The response generated by the model.
+    Yields:
+        - str: The next chunk of the response.
     """
 
     if taiwan_llm_api_key.strip():
-        client = OpenAI(
-            base_url = "https://integrate.api.nvidia.com/v1",
-            api_key = taiwan_llm_api_key
-        )
+        client = get_client(OpenAI, base_url = TAIWAN_LLM_BASE_URL, api_key = taiwan_llm_api_key)
     else:
         raise ValueError("API key is required.")
     
     # Set the prompt
-    if isinstance(prompt, str) and prompt.strip():
-        messages = [
-            {"role": "system", "content": "你是一個優秀的繁體中文助理，會提供符合使用者需求的回應。"},
-            {"role": "user", "content": prompt}
-        ]
-    elif isinstance(prompt, list) and len(prompt) > 0 and all(isinstance(item, dict) and "role" in item and item["role"] in ["user", "system", "assistant"] and "content" in item and item["content"].strip() for item in prompt):
-        messages = prompt
-    else:
-        raise ValueError("Prompt must be a non-empty string or a list.")
+    messages = format_messages(prompt)
 
     # Get the response
     try:
         completion = client.chat.completions.create(
-            model="yentinglin/llama-3-taiwan-70b-instruct",
+            model=TAIWAN_LLM_MODEL,
             messages = messages,
             temperature = 0.5,
             top_p = 1,
@@ -83,18 +204,65 @@ def taiwan_llm_response(prompt):
     except APITimeoutError:
         raise ValueError("No response from the model.")
 
-    # Format the response
-    response = ""
-    for chunk in completion:
-        if chunk.choices[0].delta.content is not None:
-            response += chunk.choices[0].delta.content
-    if not response.strip():
+    try:
+        for chunk in completion:
+            if chunk.choices[0].delta.content is not None:
+                yield chunk.choices[0].delta.content
+    finally:
+        completion.close()
+
+def iter_lines(chunks):
+    """Regroup streamed chunks into lines, yielding each non-empty line as soon as it is complete.
+
+    Args:
+        - chunks (iterable of str): The response chunks, e.g. from `taiwan_llm_stream`.
+
+    Yields:
+        - str: The next non-empty line, without the trailing newline.
+    """
+    buffer = ""
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+async def taiwan_llm_response_async(prompt):
+    """Asynchronous version of `taiwan_llm_response`."""
+    if taiwan_llm_api_key.strip():
+        client = get_client(AsyncOpenAI, base_url = TAIWAN_LLM_BASE_URL, api_key = taiwan_llm_api_key)
+    else:
+        raise ValueError("API key is required.")
+
+    messages = format_messages(prompt)
+    try:
+        completion = await client.chat.completions.create(
+            model=TAIWAN_LLM_MODEL,
+            messages = messages,
+            temperature = 0.5,
+            top_p = 1,
+            max_tokens = 2048,
+        )
+    except APITimeoutError:
+        raise ValueError("No response from the model.")
+
+    response = completion.choices[0].message.content
+    if response is None or not response.strip():
         raise ValueError("No response from the model.")
-    
     return response
 
-
-def chatgpt_response(prompt):
+# If you want to use the Taiwan LLM model, test the chat UI at it's website.
+# https://build.nvidia.com/yentinglin/llama-3-taiwan-70b-instruct
+# If it keeps showing "You are XXX in line", then the API key is not available now, please wait for a while.
+# If the response is available, then you can use the API key to call the model.
+def taiwan_llm_response(prompt):
     """Generate response from Taiwan LLM model.
 
     Args:
@@ -107,31 +275,367 @@ def chatgpt_response(prompt):
     Returns:
         - str: The response generated by the model.
     """
-    
+
+    return run_sync(taiwan_llm_response_async(prompt))
+
+
+async def chatgpt_response_async(prompt):
+    """Asynchronous version of `chatgpt_response`."""
     if chatgpt_api_key.strip():
-        client = OpenAI(api_key = chatgpt_api_key)
+        client = get_client(AsyncOpenAI, api_key = chatgpt_api_key)
     else:
         raise ValueError("API key is required.")
-    
-    # Set the prompt
-    if isinstance(prompt, str) and prompt.strip():
-        messages = [
-            {"role": "system", "content": "你是一個優秀的繁體中文助理，會提供符合使用者需求的回應。"},
-            {"role": "user", "content": prompt}
-        ]
-    elif isinstance(prompt, list) and len(prompt) > 0 and all(isinstance(item, dict) and "role" in item and item["role"] in ["user", "system", "assistant"] and "content" in item and item["content"].strip() for item in prompt):
-        messages = prompt
-    else:
-        raise ValueError("Prompt must be a non-empty string or a list.")
-    
-    # Get the response
+
+    messages = format_messages(prompt)
     try:
-        completion = client.chat.completions.create(model="gpt-4o-mini", messages = messages)
+        completion = await client.chat.completions.create(model=CHATGPT_MODEL, messages = messages)
     except APITimeoutError:
         raise ValueError("No response from the model.")
-    
-    response = completion['choices'][0]['message']['content']
+
+    response = completion.choices[0].message.content
     if response is not None:
         return response
     else:
-        raise ValueError("No response from the model.")
\ No newline at end of file
+        raise ValueError("No response from the model.")
+
+def chatgpt_response(prompt):
+    """Generate response from Taiwan LLM model.
+
+    Args:
+        - prompt (str or list of dict): The user's input prompt / the messages list to generate response.
+            For the list of dictionaries type, each dictionary should be in the form {"role": "user/system/assistant", "content": "(message)"}.
+            - "role" = "user" for user input
+            - "role" = "system" for the initial setting of the assistant
+            - "role" = "assistant" for the assistant's response.
+
+    Returns:
+        - str: The response generated by the model.
+    """
+    return run_sync(chatgpt_response_async(prompt))
+
+# The provider and model of each response function, used in the cache key.
+PROVIDER_MODELS = {
+    duckchat_response: ("duckchat", DUCKCHAT_MODEL),
+    taiwan_llm_response: ("taiwan_llm", TAIWAN_LLM_MODEL),
+    chatgpt_response: ("chatgpt", CHATGPT_MODEL),
+}
+
+# The asynchronous version of each response function.
+ASYNC_RESPONSES = {
+    duckchat_response: duckchat_response_async,
+    taiwan_llm_response: taiwan_llm_response_async,
+    chatgpt_response: chatgpt_response_async,
+}
+
+llm_disk_cache = SQLiteCache("llm", ttl=LLM_CACHE_TTL, max_entries=LLM_DISK_CACHE_MAX_ENTRIES)
+llm_memory_cache = OrderedDict()
+llm_in_flight = dict()
+llm_cache_lock = threading.Lock()
+llm_cache_stats = {"memory_hits": 0, "disk_hits": 0, "coalesced": 0, "misses": 0}
+
+def llm_cache_key(provider, model, prompt):
+    """Return the content-addressed cache key of a prompt for a provider and model."""
+    content = json.dumps([provider, model, prompt], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def cached_llm_response(prompt, respond=duckchat_response, validate=None):
+    """Generate a response through the LLM response cache.
+
+    The in-process LRU tier is checked first, then the on-disk tier. On a miss the response is generated once:
+    concurrent callers with the same provider, model and prompt wait for that call instead of sending their own.
+    Only use it where repeating the same prompt should give the same answer, e.g. spot descriptions.
+
+    Args:
+        - prompt (str or list of dict): The prompt, in any format accepted by `respond`.
+        - respond (function): The response function, one of `duckchat_response`, `taiwan_llm_response`, `chatgpt_response` or `routed_response`.
+        - validate (function or None): Returns whether a response is valid, e.g. parses as the requested JSON.
+            Passed on to `routed_response`; invalid responses are returned but never cached, and invalid cached ones are ignored.
+
+    Returns:
+        - str: The response generated by the model, or the cached one.
+    """
+    provider, model = PROVIDER_MODELS.get(respond, (respond.__name__, "default"))
+    key = llm_cache_key(provider, model, prompt)
+
+    with llm_cache_lock:
+        if key in llm_memory_cache:
+            llm_memory_cache.move_to_end(key)
+            llm_cache_stats["memory_hits"] += 1
+            tracing.count("cache.hits", provider="llm_memory")
+            return llm_memory_cache[key]
+        future = llm_in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = llm_in_flight[key] = Future()
+        else:
+            llm_cache_stats["coalesced"] += 1
+
+    # another caller is already generating this response
+    if not owner:
+        return future.result()
+
+    try:
+        response = llm_disk_cache.get(key)
+        source = "disk_hits"
+        if response is MISSING or (validate is not None and not validate(response)):
+            response = respond(prompt) if validate is None else respond(prompt, validate = validate)
+            tracing.count("llm.requests", provider=provider)
+            tracing.count("llm.bytes", len(response.encode("utf-8")), provider)
+            source = "misses"
+        valid = validate is None or validate(response)
+        if valid and source == "misses":
+            llm_disk_cache.set(key, response)
+        with llm_cache_lock:
+            llm_cache_stats[source] += 1
+            if valid:
+                llm_memory_cache[key] = response
+                if len(llm_memory_cache) > LLM_MEMORY_CACHE_SIZE:
+                    llm_memory_cache.popitem(last = False)
+        future.set_result(response)
+        return response
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with llm_cache_lock:
+            llm_in_flight.pop(key, None)
+
+async def gather_responses_async(prompts, respond=duckchat_response_async, concurrency=LLM_CONCURRENCY, return_exceptions=False):
+    """Generate responses for many prompts concurrently, with at most `concurrency` requests in flight.
+
+    Args:
+        - prompts (iterable of str or list of dict): The prompts.
+        - respond (coroutine function): The asynchronous response function, e.g. `duckchat_response_async`.
+        - concurrency (int): The maximum number of concurrent requests.
+        - return_exceptions (bool): Return the exception of a failed prompt in its place instead of raising it.
+
+    Returns:
+        - list of str: The responses, in the order of `prompts`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(prompt):
+        async with semaphore:
+            return await respond(prompt)
+
+    return await asyncio.gather(*(bounded(prompt) for prompt in prompts), return_exceptions = return_exceptions)
+
+def gather_responses(prompts, respond=duckchat_response, concurrency=LLM_CONCURRENCY, cached=False, return_exceptions=False):
+    """Generate responses for many prompts concurrently over the shared clients, see `gather_responses_async`.
+
+    Args:
+        - prompts (iterable of str or list of dict): The prompts.
+        - respond (function): The response function, one of `duckchat_response`, `taiwan_llm_response`, `chatgpt_response` or `routed_response`.
+        - concurrency (int): The maximum number of concurrent requests.
+        - cached (bool): Send each prompt through `cached_llm_response`.
+        - return_exceptions (bool): Return the exception of a failed prompt in its place instead of raising it.
+
+    Returns:
+        - list of str: The responses, in the order of `prompts`.
+    """
+    if cached:
+        # the cache is synchronous, so cached prompts wait for their response in worker threads
+        async def respond_async(prompt):
+            return await asyncio.to_thread(cached_llm_response, prompt, respond)
+    elif respond in ASYNC_RESPONSES:
+        respond_async = ASYNC_RESPONSES[respond]
+    else:
+        async def respond_async(prompt):
+            return await asyncio.to_thread(respond, prompt)
+
+    return run_sync(gather_responses_async(list(prompts), respond_async, concurrency, return_exceptions))
+
+class ProviderRouter:
+    """Route prompts across LLM providers with hedging, failover and circuit breakers.
+
+    Providers are tried in order. A request waiting longer than the provider's p95 latency gets a hedged duplicate
+    on the next provider, a failed request fails over to the next provider immediately, and the first valid answer wins.
+    After `failure_threshold` consecutive failures a provider's circuit opens for `cooldown` seconds,
+    then a single trial request decides whether it closes again.
+
+    Args:
+        - providers (list of tuple[str, coroutine function]): The (name, asynchronous response function) pairs, in order of preference.
+        - hedge_delay (float): The hedging delay in seconds used until a provider has `min_samples` latency samples.
+        - min_samples (int): The number of latency samples needed before its p95 is used.
+        - window (int): The number of recent requests kept per provider for latency and error statistics.
+        - failure_threshold (int): The number of consecutive failures opening the circuit.
+        - cooldown (float): The number of seconds an open circuit stays open.
+        - validate (function or None): Returns whether a response is valid; defaults to non-empty strings.
+    """
+
+    def __init__(self, providers, hedge_delay=ROUTER_HEDGE_DELAY, min_samples=ROUTER_MIN_SAMPLES, window=ROUTER_WINDOW,
+                 failure_threshold=ROUTER_FAILURE_THRESHOLD, cooldown=ROUTER_COOLDOWN, validate=None):
+        self.providers = list(providers)
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.validate = validate or (lambda response: isinstance(response, str) and bool(response.strip()))
+        self.lock = threading.Lock()
+        self.state = {name: {
+            "latencies": deque(maxlen = window), "outcomes": deque(maxlen = window),
+            "requests": 0, "errors": 0, "hedges": 0, "wins": 0,
+            "consecutive_failures": 0, "open_until": 0.0, "trial": False,
+        } for name, _ in self.providers}
+
+    def p95(self, name):
+        """Return the p95 latency of a provider in seconds, or None without enough samples."""
+        latencies = sorted(self.state[name]["latencies"])
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+
+    def available(self):
+        """Return the providers whose circuit lets a request through, in order of preference.
+
+        A provider whose circuit is open is skipped until the cooldown ends, then one trial request at a time goes through.
+        If every circuit is open, all providers are returned so that a request is still attempted.
+        """
+        now = time.monotonic()
+        with self.lock:
+            names = [name for name, _ in self.providers
+                     if self.state[name]["consecutive_failures"] < self.failure_threshold
+                     or (self.state[name]["open_until"] <= now and not self.state[name]["trial"])]
+        return names or [name for name, _ in self.providers]
+
+    def record(self, name, latency=None, error=False, cancelled=False):
+        """Record the outcome of a request to a provider.
+
+        A cancelled request counts as neither a success nor a failure; its `latency`, if given, is added as a sample
+        (a lower bound of the real latency).
+        """
+        with self.lock:
+            state = self.state[name]
+            state["trial"] = False
+            if cancelled:
+                if latency is not None:
+                    state["latencies"].append(latency)
+                return
+            state["outcomes"].append(not error)
+            if error:
+                state["errors"] += 1
+                state["consecutive_failures"] += 1
+                if state["consecutive_failures"] >= self.failure_threshold:
+                    state["open_until"] = time.monotonic() + self.cooldown
+            else:
+                state["latencies"].append(latency)
+                state["consecutive_failures"] = 0
+
+    async def respond(self, prompt, validate=None):
+        """Generate a response to the prompt from the fastest healthy provider.
+
+        Args:
+            - prompt (str or list of dict): The prompt.
+            - validate (function or None): Overrides the router's `validate` for this prompt.
+
+        Returns:
+            - str: The first valid response.
+        """
+        functions = dict(self.providers)
+        validate = validate or self.validate
+        candidates = deque(self.available())
+        running = dict()
+        last_error = None
+
+        def start(hedged):
+            name = candidates.popleft()
+            with self.lock:
+                state = self.state[name]
+                state["requests"] += 1
+                state["hedges"] += hedged
+                state["trial"] = state["consecutive_failures"] >= self.failure_threshold
+            tracing.count("llm.provider_requests", provider=name)
+            task = asyncio.ensure_future(functions[name](prompt))
+            running[task] = (name, time.monotonic())
+            return task
+
+        # requests that outlived their hedging delay
+        exceeded = set()
+        current = start(False)
+        try:
+            while running:
+                timeout = None
+                if candidates:
+                    name, started = running[current]
+                    delay = self.p95(name) or self.hedge_delay
+                    timeout = max(delay - (time.monotonic() - started), 0)
+                done, _ = await asyncio.wait(running, timeout = timeout, return_when = asyncio.FIRST_COMPLETED)
+                if not done:
+                    # the current provider is slower than usual: hedge on the next one
+                    exceeded.add(current)
+                    current = start(True)
+                    continue
+                for task in done:
+                    name, started = running.pop(task)
+                    error = task.exception()
+                    if error is None and validate(task.result()):
+                        self.record(name, time.monotonic() - started)
+                        with self.lock:
+                            self.state[name]["wins"] += 1
+                        return task.result()
+                    self.record(name, error = True)
+                    last_error = error or ValueError(f"Invalid response from {name}.")
+                # fail over right away instead of waiting for the hedging delay
+                if candidates:
+                    current = start(False)
+        finally:
+            # a request that outlived its hedging delay gives a censored latency sample, otherwise a provider always
+            # slower than the hedge would never get samples; a hedge that merely lost the race says nothing
+            for task, (name, started) in running.items():
+                task.cancel()
+                self.record(name, time.monotonic() - started if task in exceeded else None, cancelled = True)
+        raise last_error or ValueError("No response from the model.")
+
+    def stats(self):
+        """Return per-provider request, error, hedge and latency statistics.
+
+        Returns:
+            - dict: {provider: {"requests", "errors", "error_rate", "hedges", "wins", "p50", "p95", "circuit"}}.
+        """
+        now = time.monotonic()
+        result = dict()
+        with self.lock:
+            for name, _ in self.providers:
+                state = self.state[name]
+                latencies = sorted(state["latencies"])
+                outcomes = state["outcomes"]
+                if state["consecutive_failures"] < self.failure_threshold:
+                    circuit = "closed"
+                else:
+                    circuit = "open" if state["open_until"] > now else "half-open"
+                result[name] = {
+                    "requests": state["requests"],
+                    "errors": state["errors"],
+                    "error_rate": outcomes.count(False) / len(outcomes) if outcomes else 0.0,
+                    "hedges": state["hedges"],
+                    "wins": state["wins"],
+                    "p50": latencies[len(latencies) // 2] if latencies else None,
+                    "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None,
+                    "circuit": circuit,
+                }
+        return result
+
+llm_router = ProviderRouter([
+    ("duckchat", duckchat_response_async),
+    ("taiwan_llm", taiwan_llm_response_async),
+    ("chatgpt", chatgpt_response_async),
+])
+
+async def routed_response_async(prompt, validate=None):
+    """Asynchronous version of `routed_response`."""
+    return await llm_router.respond(prompt, validate)
+
+def routed_response(prompt, validate=None):
+    """Generate response from whichever provider answers first, see `ProviderRouter`.
+
+    Args:
+        - prompt (str or list of dict): The user's input prompt / the messages list, see `taiwan_llm_response`.
+        - validate (function or None): Returns whether a response is valid; defaults to non-empty strings.
+
+    Returns:
+        - str: The response generated by the model.
+    """
+    return run_sync(routed_response_async(prompt, validate))
+
+PROVIDER_MODELS[routed_response] = ("router", "auto")
+ASYNC_RESPONSES[routed_response] = routed_response_async
@@ -4,18 +4,84 @@
 # In[1]:
 
 
+import os
 import requests
 import math
+import hashlib
 import folium
 from geopy.geocoders import Nominatim
 import flexpolyline as fp
 import random
+import time
+import itertools
+import threading
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+try:
+    import numpy as np
+except ImportError:  # 未安裝 numpy 時改用純 Python 計算
+    np = None
+from cache import SQLiteCache, MISSING
+import transport
+import tracing
+from poi_index import load_poi_index, format_osm_address
+from county_index import load_county_index
+from gazetteer import load_gazetteer
 
 
 # 使用到的MAP API KEY:
 API_KEY_1 = ""  #HERE API(用於get_map get_travel_times)
 API_KEY_2 = ""  #GOOGLE MAP API(用於get_coordinates get_address find_nearby_restaurant)
 
+# 地理編碼快取設定
+GEOCODE_CACHE_TTL = 30 * 24 * 3600  # 正向結果保存 30 天
+GEOCODE_NEGATIVE_TTL = 24 * 3600  # 查無結果的地點名稱保存 1 天
+GEOCODE_CACHE_MAX_ENTRIES = 50000
+REVERSE_GEOCODE_PRECISION = 5  # 反向查詢座標取到小數點後 5 位（約 1 公尺）
+
+# 離線 POI 索引（poi_index.build_poi_index 的輸出路徑前綴），未建立時使用線上 API
+POI_INDEX_PATH = os.environ.get("TRIP_POI_INDEX", "taiwan_poi")
+
+# 離線縣市邊界索引（county_index.build_county_index 的輸出），範圍外才使用 Nominatim
+COUNTY_INDEX_PATH = os.environ.get("TRIP_COUNTY_INDEX", "taiwan_counties.npz")
+
+# 附近地點搜尋的網格快取：geohash 6 碼約 1.2 x 0.6 公里，同一網格內的查詢共用結果
+NEARBY_GEOHASH_PRECISION = 6
+NEARBY_CACHE_TTL = 7 * 24 * 3600
+
+# 地點數不超過此值時使用精確解（Held-Karp），否則使用模擬退火
+EXACT_SOLVER_MAX_N = 12
+# Held-Karp 所需記憶體為 O(2^n * n)，超過此地點數即拒絕執行
+HELD_KARP_MAX_N = 16
+# 限時求解的預設時間預算（毫秒）
+ROUTE_TIME_BUDGET_MS = 1000
+# 同一組地點中同時查詢的路段數
+ROUTE_LEG_CONCURRENCY = 8
+# 逐日生成行程時同時處理的天數
+ROUTE_DAY_CONCURRENCY = 4
+# 路段快取設定：起訖點座標取到小數點後 ROUTE_CACHE_PRECISION 位（4 位約 11 公尺）作為快取鍵
+ROUTE_CACHE_PRECISION = 4
+ROUTE_CACHE_TTL = 7 * 24 * 3600  # 路況會變動，路段保存 7 天
+ROUTE_CACHE_MAX_ENTRIES = 100000
+# HERE Matrix Routing 彈性模式（自訂 transportMode，區域為涵蓋所有地點的圓形 autoCircle）同步請求的大小上限，超過時分塊查詢
+MATRIX_MAX_ORIGINS = 15
+MATRIX_MAX_DESTINATIONS = 100
+MATRIX_CACHE_TTL = 7 * 24 * 3600
+# 矩陣中無法抵達的路段，以直線距離和此車速（公里/小時）估計行車時間
+MATRIX_FALLBACK_SPEED_KMH = 30
+
+coordinate_cache = SQLiteCache("geocode", ttl=GEOCODE_CACHE_TTL, max_entries=GEOCODE_CACHE_MAX_ENTRIES)
+address_cache = SQLiteCache("reverse_geocode", ttl=GEOCODE_CACHE_TTL, max_entries=GEOCODE_CACHE_MAX_ENTRIES)
+# polyline 以 HERE 的 flexible polyline 編碼字串保存，比解碼後的座標串列精簡許多
+route_leg_cache = SQLiteCache("route_leg", ttl=ROUTE_CACHE_TTL, max_entries=ROUTE_CACHE_MAX_ENTRIES)
+nearby_cache = SQLiteCache("nearby", ttl=NEARBY_CACHE_TTL, max_entries=ROUTE_CACHE_MAX_ENTRIES)
+travel_time_matrix_cache = SQLiteCache("travel_time_matrix", ttl=MATRIX_CACHE_TTL, max_entries=ROUTE_CACHE_MAX_ENTRIES)
+
+# 附近地點搜尋的請求數統計
+nearby_stats = {"lookups": 0, "requests": 0, "cache_hits": 0, "max_requests": 0, "last": None}
+nearby_stats_lock = threading.Lock()
+
 
 # 將多個子陣列的陣列依照指定大小切分為多個群組
 def split_array(array, chunk_size):
@@ -37,8 +103,33 @@ def get_midpoint(lat1, lon1, lat2, lon2):
     
     return mid_lat, mid_lon
 
+# 正規化地點名稱作為快取鍵（全形轉半形、合併空白）
+def normalize_name(name):
+    return " ".join(unicodedata.normalize("NFKC", name).split())
+
+# 回傳地理編碼快取的命中統計
+def geocode_cache_stats():
+    return {"get_coordinate": coordinate_cache.stats(), "get_address": address_cache.stats()}
+
+# 回傳路段快取的命中統計
+def route_cache_stats():
+    return route_leg_cache.stats()
+
 # 獲取地點座標資料
 def get_coordinate(attraction):
+    # 優先查詢本地景點名錄
+    gazetteer = load_gazetteer()
+    entry = gazetteer.lookup(attraction) if gazetteer is not None else None
+    if entry is not None:
+        # 名錄中缺少地址的景點改用（有快取的）反向查詢
+        return (attraction, entry[1], entry[2], entry[3] or get_address(entry[1], entry[2]))
+
+    key = normalize_name(attraction)
+    cached = coordinate_cache.get(key)
+    if cached is not MISSING:
+        # 快取中的 False 代表曾查無結果
+        return (attraction, *cached[1:]) if cached else False
+
     api_key = API_KEY_2
     
     coordinate = []
@@ -50,7 +141,7 @@ def get_coordinate(attraction):
         "language": "zh-TW"  # 使用繁體中文返回結果
     }
     
-    response = requests.get(url, params=params)
+    response = transport.get(url, params=params)
     if response.status_code == 200:
         data = response.json()
         if data.get("results"):
@@ -59,14 +150,23 @@ def get_coordinate(attraction):
             lat = result["geometry"]["location"]["lat"]
             lon = result["geometry"]["location"]["lng"]
             formatted_address = result["formatted_address"]
+            coordinate_cache.set(key, [name, lat, lon, formatted_address])
             return (name, lat, lon, formatted_address)
         else:
+            # 僅快取「查無結果」，配額不足等暫時性錯誤不快取
+            if data.get("status") == "ZERO_RESULTS":
+                coordinate_cache.set(key, False, ttl=GEOCODE_NEGATIVE_TTL)
             return False
     else:
         return False
 
 # 用座標查詢中文地址
 def get_address(lat, lon):
+    key = f"{round(lat, REVERSE_GEOCODE_PRECISION)},{round(lon, REVERSE_GEOCODE_PRECISION)}"
+    cached = address_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
     # Google Maps Geocoding API 的 URL
     url = "https://maps.googleapis.com/maps/api/geocode/json"
     
@@ -81,7 +181,7 @@ def get_address(lat, lon):
     
     try:
         # 發送 API 請求
-        response = requests.get(url, params=params)
+        response = transport.get(url, params=params)
         response.raise_for_status()  # 檢查是否成功請求
         data = response.json()
         
@@ -89,68 +189,310 @@ def get_address(lat, lon):
         if "results" in data and len(data["results"]) > 0:
             # 使用第一個結果作為地址
             formatted_address = data["results"][0].get("formatted_address", "地址未知")
+            address_cache.set(key, formatted_address)
             return formatted_address
         else:
             print("未找到相關地址資訊。")
+            if data.get("status") == "ZERO_RESULTS":
+                address_cache.set(key, "地址未知", ttl=GEOCODE_NEGATIVE_TTL)
             return "地址未知"
     except requests.exceptions.RequestException as e:
         print(f"地址查詢失敗: {e}")
         return "地址未知"
 
-# 創建距離矩陣
+# 創建距離矩陣（有 numpy 時回傳連續的 float64 陣列，否則回傳巢狀串列）
 def create_distance_matrix(locations):
+    if np is not None:
+        return haversine_matrix(np.array([(loc[1], loc[2]) for loc in locations], dtype=float).reshape(-1, 2))
+
     size = len(locations)
-    matrix = [[0] * size for _ in range(size)]
+    matrix = [[0.0] * size for _ in range(size)]
+    # 距離矩陣為對稱矩陣，只計算上三角再複製到下三角
     for i in range(size):
-        for j in range(size):
-            if i != j:
-                lat1, lon1 = locations[i][1], locations[i][2]
-                lat2, lon2 = locations[j][1], locations[j][2]
-                matrix[i][j] = haversine(lat1, lon1, lat2, lon2)
+        for j in range(i + 1, size):
+            lat1, lon1 = locations[i][1], locations[i][2]
+            lat2, lon2 = locations[j][1], locations[j][2]
+            matrix[i][j] = matrix[j][i] = haversine(lat1, lon1, lat2, lon2)
     return matrix
 
+# 以 numpy 向量化計算 n×n 的 Haversine 距離矩陣，coordinates 為 (n, 2) 的緯度、經度陣列
+def haversine_matrix(coordinates):
+    R = 6371  # 地球半徑（公里）
+    lat = np.radians(coordinates[:, 0])
+    lon = np.radians(coordinates[:, 1])
+    cos_lat = np.cos(lat)
+    a = (np.sin((lat[:, None] - lat[None, :]) / 2) ** 2
+         + cos_lat[:, None] * cos_lat[None, :] * np.sin((lon[:, None] - lon[None, :]) / 2) ** 2)
+    # 浮點誤差可能使 a 略超出 [0, 1]
+    np.clip(a, 0.0, 1.0, out=a)
+    matrix = 2 * R * np.arcsin(np.sqrt(a))
+    np.fill_diagonal(matrix, 0.0)
+    return np.ascontiguousarray(matrix)
+
+# 將非對稱的成本矩陣（如行車時間）轉為對稱矩陣 (A + Aᵀ) / 2，供假設對稱的 2-opt 使用
+def symmetrize_matrix(matrix):
+    if np is not None:
+        matrix = np.asarray(matrix, dtype=float)
+        return np.ascontiguousarray((matrix + matrix.T) / 2)
+    size = len(matrix)
+    return [[(matrix[i][j] + matrix[j][i]) / 2 for j in range(size)] for i in range(size)]
+
 # TSP 路徑分析 - simulated annealing
-def simulated_annealing(locations, initial_temperature=1000, cooling_rate=0.995, max_iterations=10000):
-    distance_matrix = create_distance_matrix(locations)  
+# restarts > 1 時以多個行程平行執行 restarts 條獨立的退火鏈（各自的隨機種子），取最短的路徑
+# distance_matrix 可傳入自訂成本矩陣（如 get_travel_time_matrix 的行車時間），未提供時使用直線距離
+@tracing.traced()
+def simulated_annealing(locations, initial_temperature=1000, cooling_rate=0.995, max_iterations=10000, seed=None, restarts=1, max_workers=None, distance_matrix=None):
+    if distance_matrix is None:
+        distance_matrix = create_distance_matrix(locations)  
+    else:
+        distance_matrix = symmetrize_matrix(distance_matrix)
     n = len(distance_matrix)
+    rng = random.Random(seed)
     
-    # 初始化
-    current_route = list(range(n))  # 初始路徑 [0, 1, 2, ..., n-1]
-    random.shuffle(current_route)
-    current_distance = calculate_route_distance(distance_matrix, current_route)
-    best_route = current_route[:]
+    if restarts > 1:
+        seeds = [rng.randrange(2**32) for _ in range(restarts)]
+        best_route, best_distance = multistart_annealing(distance_matrix, seeds, initial_temperature, cooling_rate, max_iterations, max_workers)
+    else:
+        # 初始化
+        route = list(range(n))  # 初始路徑 [0, 1, 2, ..., n-1]
+        rng.shuffle(route)
+        best_route, best_distance = anneal_route(distance_matrix, route, initial_temperature, cooling_rate, max_iterations, rng)
+    
+    # 根據最佳路徑返回相應的完整地點數據
+    route_locations = [locations[i] for i in best_route]
+
+    # 返回排序後的完整地點及最佳距離
+    return route_locations
+
+# 以增量計算成本的方式進行退火，每次迭代只評估被更動的邊（O(1)），不複製整條路徑
+# 鄰域包含：交換兩點、2-opt 區段反轉、Or-opt 區段（1~3 點）搬移
+# 指定 deadline（time.perf_counter() 的時間點）時改為依經過時間由 initial_temperature 降到 final_temperature，
+# 時間到即返回目前最佳解；patience 為降溫至低溫階段（低於起始溫度的 1%）後，最佳解連續未改善多少次迭代即提前結束；
+# on_progress(iteration, best_distance) 每 check_interval 次迭代回報一次進度
+def anneal_route(distance_matrix, route, initial_temperature=1000, cooling_rate=0.995, max_iterations=10000, rng=random,
+                 deadline=None, final_temperature=1e-3, patience=None, on_progress=None, check_interval=256):
+    # numpy 陣列逐一取值較慢，退火時改用巢狀串列
+    dist = distance_matrix.tolist() if hasattr(distance_matrix, "tolist") else distance_matrix
+    route = route[:]
+    n = len(route)
+    current_distance = calculate_route_distance(dist, route)
+    best_route = route[:]
     best_distance = current_distance
+    # 少於 4 個地點時所有封閉路徑長度相同
+    if n < 4:
+        return best_route, best_distance
 
     temperature = initial_temperature
+    start = time.perf_counter()
+    stale_iterations = 0
+    best_at_check = best_distance
 
-    for iteration in range(max_iterations):
-        # 隨機交換兩個地點的位置
-        new_route = current_route[:]
-        i, j = random.sample(range(n), 2)
-        new_route[i], new_route[j] = new_route[j], new_route[i]
+    for iteration in (range(max_iterations) if max_iterations is not None else itertools.count()):
+        if iteration % check_interval == 0 and iteration:
+            if on_progress is not None:
+                on_progress(iteration, best_distance)
+            if deadline is not None:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                # 依剩餘時間比例做指數降溫
+                temperature = initial_temperature * (final_temperature / initial_temperature) ** ((now - start) / (deadline - start))
+            if patience is not None and temperature < initial_temperature * 1e-2:
+                stale_iterations = stale_iterations + check_interval if best_distance >= best_at_check else 0
+                if stale_iterations > patience:
+                    break
+            best_at_check = best_distance
 
-        # 計算新路徑的距離
-        new_distance = calculate_route_distance(distance_matrix, new_route)
+        move = rng.randrange(3)
+        if move == 0:
+            # 交換兩個地點：先交換再計算受影響的邊，不接受則換回
+            i, j = rng.sample(range(n), 2)
+            edges = {(i - 1) % n, i, (j - 1) % n, j}
+            old = sum(dist[route[k]][route[(k + 1) % n]] for k in edges)
+            route[i], route[j] = route[j], route[i]
+            delta = sum(dist[route[k]][route[(k + 1) % n]] for k in edges) - old
+            accepted = delta < 0 or rng.random() < math.exp(-delta / temperature)
+            if not accepted:
+                route[i], route[j] = route[j], route[i]
+        elif move == 1:
+            # 2-opt：反轉 route[i..j]，只有兩條邊改變（假設距離矩陣對稱）
+            i, j = sorted(rng.sample(range(n), 2))
+            a, b = route[i - 1], route[i]
+            c, d = route[j], route[(j + 1) % n]
+            delta = dist[a][c] + dist[b][d] - dist[a][b] - dist[c][d]
+            # 反轉整條路徑等同原路徑，不需處理
+            accepted = not (i == 0 and j == n - 1) and (delta < 0 or rng.random() < math.exp(-delta / temperature))
+            if accepted:
+                route[i:j + 1] = route[i:j + 1][::-1]
+        else:
+            # Or-opt：將從 i 開始、長度為 length 的區段搬到邊 (route[p], route[p+1]) 之間
+            length = rng.randint(1, min(3, n - 3))
+            i = rng.randrange(n - length + 1)
+            p = (i + length + rng.randrange(n - length - 1)) % n
+            prev, first = route[i - 1], route[i]
+            last, after = route[i + length - 1], route[(i + length) % n]
+            u, v = route[p], route[(p + 1) % n]
+            delta = (dist[prev][after] - dist[prev][first] - dist[last][after]
+                     + dist[u][first] + dist[last][v] - dist[u][v])
+            accepted = delta < 0 or rng.random() < math.exp(-delta / temperature)
+            if accepted:
+                segment = route[i:i + length]
+                del route[i:i + length]
+                insert_at = p + 1 if p < i else p - length + 1
+                route[insert_at:insert_at] = segment
 
-        # 接受或拒絕新路徑
-        if accept_solution(current_distance, new_distance, temperature):
-            current_route = new_route
-            current_distance = new_distance
+        if accepted:
+            current_distance += delta
             # 如果新路徑更好，更新最佳路徑
-            if new_distance < best_distance:
-                best_route = new_route
-                best_distance = new_distance
+            if current_distance < best_distance - 1e-9:
+                best_route = route[:]
+                best_distance = current_distance
 
-        # 降低溫度
-        temperature *= cooling_rate
-        if temperature < 1e-8:  # 終止條件：溫度過低
-            break
-    
-    # 根據最佳路徑返回相應的完整地點數據
-    route_locations = [locations[i] for i in best_route]
+        # 降低溫度（限時模式下溫度由經過時間決定）
+        if deadline is None:
+            temperature *= cooling_rate
+            if temperature < 1e-8:  # 終止條件：溫度過低
+                break
 
-    # 返回排序後的完整地點及最佳距離
-    return route_locations
+    # 重新計算以消除累加的浮點誤差
+    return best_route, calculate_route_distance(dist, best_route)
+
+# 在行程池中執行多條退火鏈，距離矩陣只在每個工作行程初始化時傳遞一次
+# 有 numpy 時透過共享記憶體傳遞，避免每個任務都序列化整個矩陣
+def multistart_annealing(distance_matrix, seeds, initial_temperature=1000, cooling_rate=0.995, max_iterations=10000, max_workers=None):
+    shm = None
+    if np is not None:
+        matrix = np.ascontiguousarray(distance_matrix, dtype=np.float64)
+        shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf)[:] = matrix
+        initargs = (shm.name, matrix.shape, None)
+    else:
+        initargs = (None, None, distance_matrix)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_annealing_worker, initargs=initargs) as executor:
+            results = list(executor.map(_annealing_chain, seeds, [initial_temperature] * len(seeds),
+                                        [cooling_rate] * len(seeds), [max_iterations] * len(seeds)))
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    return min(results, key=lambda result: result[1])
+
+# 工作行程中的距離矩陣
+_worker_distance_matrix = None
+
+def _init_annealing_worker(shm_name, shape, distance_matrix):
+    global _worker_distance_matrix
+    if shm_name is not None:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        # 轉成巢狀串列供退火使用，之後即可關閉共享記憶體
+        _worker_distance_matrix = np.ndarray(shape, dtype=np.float64, buffer=shm.buf).tolist()
+        shm.close()
+    else:
+        _worker_distance_matrix = distance_matrix
+
+def _annealing_chain(seed, initial_temperature, cooling_rate, max_iterations):
+    rng = random.Random(seed)
+    route = list(range(len(_worker_distance_matrix)))
+    rng.shuffle(route)
+    return anneal_route(_worker_distance_matrix, route, initial_temperature, cooling_rate, max_iterations, rng)
+
+# TSP 精確解 - Held-Karp 位元遮罩動態規劃，O(2^n * n^2) 時間
+# closed=True 為回到起點的封閉路徑（固定由地點 0 出發），closed=False 為不限起訖點的開放路徑
+def held_karp(distance_matrix, closed=True, max_n=HELD_KARP_MAX_N):
+    dist = distance_matrix.tolist() if hasattr(distance_matrix, "tolist") else distance_matrix
+    n = len(dist)
+    if n > max_n:
+        raise ValueError(f"Held-Karp 最多支援 {max_n} 個地點，目前有 {n} 個。")
+
+    if not closed:
+        # 加入與所有地點距離皆為 0 的虛擬地點，封閉路徑去掉虛擬地點即為最佳開放路徑
+        padded = [[0.0] * (n + 1)] + [[0.0] + list(row) for row in dist]
+        route, distance = held_karp(padded, closed=True, max_n=max_n + 1)
+        return [i - 1 for i in route[1:]], distance
+
+    if n <= 2:
+        route = list(range(n))
+        return route, calculate_route_distance(dist, route) if n else 0.0
+
+    # 地點 1..n-1 對應遮罩的第 0..m-1 位元，dp[mask][j] 為從地點 0 出發、走過 mask 且停在 j 的最短距離
+    m = n - 1
+    full = (1 << m) - 1
+    dp = [[math.inf] * m for _ in range(full + 1)]
+    parent = [[-1] * m for _ in range(full + 1)]
+    for j in range(m):
+        dp[1 << j][j] = dist[0][j + 1]
+
+    for mask in range(1, full):
+        costs = dp[mask]
+        for j in range(m):
+            cost = costs[j]
+            if cost == math.inf:
+                continue
+            row = dist[j + 1]
+            for k in range(m):
+                if mask & (1 << k):
+                    continue
+                next_mask = mask | (1 << k)
+                new_cost = cost + row[k + 1]
+                if new_cost < dp[next_mask][k]:
+                    dp[next_mask][k] = new_cost
+                    parent[next_mask][k] = j
+
+    # 回到起點並還原路徑
+    last = min(range(m), key=lambda j: dp[full][j] + dist[j + 1][0])
+    distance = dp[full][last] + dist[last + 1][0]
+    route = []
+    mask = full
+    while last != -1:
+        route.append(last + 1)
+        mask, last = mask ^ (1 << last), parent[mask][last]
+    route.append(0)
+    route.reverse()
+    return route, distance
+
+# 限時求解：在 time_budget_ms 毫秒內回傳目前找到的最佳路徑
+# 起始溫度依平均邊長縮放，低溫階段最佳解在約 200n 次迭代內未改善即提前結束；on_progress(iteration, best_distance) 回報進度
+def anytime_route(locations, time_budget_ms=ROUTE_TIME_BUDGET_MS, on_progress=None, seed=None, distance_matrix=None):
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    if distance_matrix is None:
+        distance_matrix = create_distance_matrix(locations)
+    n = len(locations)
+    rng = random.Random(seed)
+
+    if n <= EXACT_SOLVER_MAX_N:
+        route, distance = held_karp(distance_matrix)
+        if on_progress is not None:
+            on_progress(0, distance)
+        return [locations[i] for i in route]
+
+    distance_matrix = symmetrize_matrix(distance_matrix)
+    dist = distance_matrix.tolist() if hasattr(distance_matrix, "tolist") else distance_matrix
+    # 起始溫度為平均邊長；所有地點重合時平均邊長為 0，以極小的正數代替避免除以零
+    temperature = max(sum(map(sum, dist)) / (n * (n - 1)), 1e-6)
+    route = list(range(n))
+    rng.shuffle(route)
+    best_route, best_distance = anneal_route(dist, route, initial_temperature=temperature, max_iterations=None, rng=rng,
+                                             deadline=deadline, final_temperature=temperature * 1e-4,
+                                             patience=max(5000, 200 * n), on_progress=on_progress)
+    if on_progress is not None:
+        on_progress(-1, best_distance)
+    return [locations[i] for i in best_route]
+
+# 依地點數自動選擇求解器：少量地點用精確解，大量地點用模擬退火；指定 time_budget_ms 時改用限時求解
+# distance_matrix 可傳入自訂成本矩陣，精確解可直接處理非對稱矩陣；exact_max_n 不能超過 HELD_KARP_MAX_N 的記憶體上限
+@tracing.traced()
+def solve_route(locations, exact_max_n=EXACT_SOLVER_MAX_N, time_budget_ms=None, distance_matrix=None, **annealing_options):
+    if len(locations) <= min(exact_max_n, HELD_KARP_MAX_N):
+        if distance_matrix is None:
+            distance_matrix = create_distance_matrix(locations)
+        route, _ = held_karp(distance_matrix)
+        return [locations[i] for i in route]
+    if time_budget_ms is not None:
+        return anytime_route(locations, time_budget_ms, distance_matrix=distance_matrix, **annealing_options)
+    return simulated_annealing(locations, distance_matrix=distance_matrix, **annealing_options)
 
 def calculate_route_distance(distance_matrix, route):
     """計算路徑的總距離，包括回到起點"""
@@ -162,10 +504,162 @@ def accept_solution(current_distance, new_distance, temperature):
         return True
     return random.random() < math.exp((current_distance - new_distance) / temperature)
 
+# 容量限制的 k-means：將地點分成 ceil(n / capacity) 群，每群最多 capacity 個地點，回傳每個地點的群編號
+# points 為平面座標（公里）；每輪依「地點到群中心的距離」由近到遠分配，額滿的群不再接受地點，收斂後再以兩兩交換改善
+def balanced_kmeans(points, capacity, max_iterations=30, seed=None):
+    n = len(points)
+    k = math.ceil(n / capacity)
+    rng = random.Random(seed)
+    squared = lambda p, c: (p[0] - c[0]) ** 2 + (p[1] - c[1]) ** 2
+
+    # k-means++ 初始化，weights 為每個地點到最近中心的距離平方
+    centers = [points[rng.randrange(n)]]
+    weights = [squared(point, centers[0]) for point in points]
+    while len(centers) < k:
+        centers.append(rng.choices(points, weights)[0] if sum(weights) > 0 else points[rng.randrange(n)])
+        weights = [min(weight, squared(point, centers[-1])) for weight, point in zip(weights, points)]
+
+    labels = None
+    for _ in range(max_iterations):
+        # 所有（地點, 群）組合依距離由近到遠排序
+        if np is not None:
+            distances = ((np.asarray(points)[:, None, :] - np.asarray(centers)[None, :, :]) ** 2).sum(axis=2)
+            pairs = zip(*np.unravel_index(np.argsort(distances, axis=None, kind="stable"), distances.shape))
+        else:
+            pairs = (pair[1:] for pair in sorted((squared(point, center), i, j) for i, point in enumerate(points) for j, center in enumerate(centers)))
+        new_labels = [-1] * n
+        sizes = [0] * k
+        assigned = 0
+        for i, j in pairs:
+            if new_labels[i] < 0 and sizes[j] < capacity:
+                new_labels[i] = int(j)
+                sizes[j] += 1
+                assigned += 1
+                if assigned == n:
+                    break
+        if new_labels == labels:
+            break
+        labels = new_labels
+        sums = [[0.0, 0.0] for _ in range(k)]
+        for point, label in zip(points, labels):
+            sums[label][0] += point[0]
+            sums[label][1] += point[1]
+        centers = [(total[0] / sizes[j], total[1] / sizes[j]) if sizes[j] else centers[j] for j, total in enumerate(sums)]
+
+    # 交換不同群的兩個地點，若能縮短兩者到各自群中心的距離和就接受（群大小不變）
+    # 只考慮兩群中心相近（互為最近的數個群）的地點
+    near = [set(sorted(range(k), key=lambda other: squared(centers[j], centers[other]))[:6]) for j in range(k)]
+    members = [[i for i in range(n) if labels[i] == j] for j in range(k)]
+    improved = True
+    while improved:
+        improved = False
+        for a in range(n):
+            for other in near[labels[a]]:
+                if other == labels[a]:
+                    continue
+                for b in members[other]:
+                    ca, cb = centers[labels[a]], centers[labels[b]]
+                    if squared(points[a], cb) + squared(points[b], ca) < squared(points[a], ca) + squared(points[b], cb) - 1e-9:
+                        members[labels[a]][members[labels[a]].index(a)] = b
+                        members[other][members[other].index(b)] = a
+                        labels[a], labels[b] = labels[b], labels[a]
+                        improved = True
+                        break
+                if improved and labels[a] == other:
+                    break
+    return labels
+
+# 開放路徑的總距離（不回到起點）
+def path_distance(distance_matrix, path):
+    return sum(distance_matrix[path[i]][path[i + 1]] for i in range(len(path) - 1))
+
+# 最短開放路徑：地點數不超過 EXACT_SOLVER_MAX_N 時用精確解（開放路徑會多一個虛擬節點），
+# 否則以模擬退火求封閉路徑後去掉最長的一段
+def shortest_open_path(distance_matrix, seed=None):
+    n = len(distance_matrix)
+    if n <= EXACT_SOLVER_MAX_N:
+        path, _ = held_karp(distance_matrix, closed=False)
+        return path
+    tour, _ = anneal_route(distance_matrix, list(range(n)), rng=random.Random(seed))
+    cut = max(range(n), key=lambda i: distance_matrix[tour[i]][tour[(i + 1) % n]])
+    return tour[cut + 1:] + tour[:cut + 1]
+
+# 先分群再排路徑：以容量限制的分群將景點分配到各天（每天 per_day 個），各天獨立求最短開放路徑，
+# 再排列天數順序並決定每天的行進方向，使前一天最後一個景點（旅館附近）到隔天第一個景點的移動最短
+# 回傳每天依造訪順序排列的地點串列；distance_matrix 可傳入自訂成本矩陣（例如行車時間）
+@tracing.traced()
+def cluster_route(locations, per_day=3, distance_matrix=None, seed=None):
+    n = len(locations)
+    if n == 0:
+        return []
+    if distance_matrix is None:
+        distance_matrix = create_distance_matrix(locations)
+    dist = distance_matrix.tolist() if hasattr(distance_matrix, "tolist") else distance_matrix
+
+    # 以經緯度投影到平面（公里）後分群
+    scale = math.cos(math.radians(sum(loc[1] for loc in locations) / n))
+    points = [(loc[1] * 111.32, loc[2] * 111.32 * scale) for loc in locations]
+    labels = balanced_kmeans(points, per_day, seed=seed)
+    days = [day for day in ([i for i in range(n) if labels[i] == j] for j in range(max(labels) + 1)) if day]
+
+    # 各天的最短開放路徑（每天只有數個地點，精確解僅需數微秒）
+    paths = []
+    for day in days:
+        order = shortest_open_path([[dist[a][b] for b in day] for a in day], seed)
+        paths.append([day[i] for i in order])
+
+    # 以各天的中心點排列天數順序
+    centroids = [("", sum(locations[i][1] for i in day) / len(day), sum(locations[i][2] for i in day) / len(day), "") for day in days]
+    centroid_matrix = create_distance_matrix(centroids)
+    day_order = shortest_open_path(centroid_matrix, seed)
+    paths = [paths[i] for i in day_order]
+
+    # 動態規劃決定每天正向或反向走，cost[o] 為目前這天以方向 o 結束時的最小總成本
+    oriented = [(path, path[::-1]) for path in paths]
+    cost = [path_distance(dist, oriented[0][o]) for o in range(2)]
+    choices = []
+    for d in range(1, len(oriented)):
+        new_cost, choice = [], []
+        for o in range(2):
+            start = oriented[d][o][0]
+            previous = min(range(2), key=lambda p: cost[p] + dist[oriented[d - 1][p][-1]][start])
+            new_cost.append(cost[previous] + dist[oriented[d - 1][previous][-1]][start] + path_distance(dist, oriented[d][o]))
+            choice.append(previous)
+        cost = new_cost
+        choices.append(choice)
+    orientation = [min(range(2), key=lambda o: cost[o])]
+    for choice in reversed(choices):
+        orientation.append(choice[orientation[-1]])
+    orientation.reverse()
+
+    return [[locations[i] for i in oriented[d][o]] for d, o in enumerate(orientation)]
+
+# 從離線索引批次查詢多個座標所在的縣市，範圍外的座標為 None；索引不存在時回傳 None
+def get_counties_offline(lats, lons):
+    index = load_county_index(COUNTY_INDEX_PATH) if COUNTY_INDEX_PATH else None
+    if index is None:
+        return None
+    return [format_county(index.counties[i]) if i >= 0 else None for i in index.lookup_many(lats, lons)]
+
+# 去掉縣市名稱中的「County」、「City」字樣，與 Nominatim 回傳的城市名稱一致
+def format_county(name):
+    name = str(name).replace("County", "").replace("City", "").strip()
+    return f"{name}, Taiwan"
+
+# 共用的 Nominatim 客戶端
+geolocator = None
+
 # 獲取座標所在的縣市名稱
 def get_county(lat, lon):
+    # 優先使用離線索引
+    counties = get_counties_offline([lat], [lon])
+    if counties and counties[0]:
+        return counties[0]
+
     # 初始化 geolocator
-    geolocator = Nominatim(user_agent="myGeocoder")
+    global geolocator
+    if geolocator is None:
+        geolocator = Nominatim(user_agent="myGeocoder")
     
     try:
         # 進行反向查詢
@@ -200,44 +694,138 @@ def get_county(lat, lon):
         print(f"Error during geocoding: {e}")  # 打印具體錯誤信息
         return 'Unknown'
 
-# 生成路徑地圖
-def get_map(locations, transMode="car"):
-    # API 密鑰
+# 路段快取鍵：移動方式與取整後的起訖點座標
+def route_leg_key(origin, destination, transport_mode, precision=ROUTE_CACHE_PRECISION):
+    snap = lambda point: f"{round(point[0], precision)},{round(point[1], precision)}"
+    return f"{transport_mode}:{snap(origin)}:{snap(destination)}"
+
+# 查詢單一路段，一次取得行車時間、距離與 polyline，供 get_map 與 get_travel_times 共用
+# 回傳 {"duration": 秒, "length": 公尺, "polyline": 編碼後的 flexible polyline}，失敗時回傳 None
+def get_route_leg(origin, destination, transport_mode="car"):
+    key = route_leg_key(origin, destination, transport_mode)
+    cached = route_leg_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
     api_key = API_KEY_1
-    
+
+    # 構建請求 URL
+    url = (
+        f"https://router.hereapi.com/v8/routes"
+        f"?transportMode={transport_mode}"
+        f"&origin={origin[0]},{origin[1]}"
+        f"&destination={destination[0]},{destination[1]}"
+        f"&return=summary,polyline"
+        f"&apiKey={api_key}"
+    )
+
+    # 發送 GET 請求
+    response = transport.get(url)
+
+    if response.status_code == 200:
+        route_data = response.json()
+        section = route_data['routes'][0]['sections'][0]
+        leg = {
+            "duration": section['summary']['duration'],
+            "length": section['summary'].get('length'),
+            "polyline": section['polyline'],
+        }
+        route_leg_cache.set(key, leg)
+        return leg
+    else:
+        print(f"請求失敗，狀態碼: {response.status_code}")
+        return None
+
+# 同時查詢所有相鄰地點之間的路段，回傳順序與地點順序一致
+@tracing.traced()
+def get_route_legs(locations, transport_mode="car", max_workers=ROUTE_LEG_CONCURRENCY):
+    pairs = [((locations[i][1], locations[i][2]), (locations[i + 1][1], locations[i + 1][2])) for i in range(len(locations) - 1)]
+    if not pairs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pairs))) as executor:
+        return list(executor.map(tracing.propagate(lambda pair: get_route_leg(pair[0], pair[1], transport_mode)), pairs))
+
+# 查詢一個區塊的行車時間矩陣（秒），無法抵達的路段為 None，請求失敗時回傳 None
+def get_travel_time_block(origins, destinations, transport_mode="car"):
+    snap = lambda point: f"{round(point[0], ROUTE_CACHE_PRECISION)},{round(point[1], ROUTE_CACHE_PRECISION)}"
+    key = hashlib.sha1(f"{transport_mode}|{';'.join(map(snap, origins))}|{';'.join(map(snap, destinations))}".encode()).hexdigest()
+    cached = travel_time_matrix_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    url = f"https://matrix.router.hereapi.com/v8/matrix?async=false&apiKey={API_KEY_1}"
+    body = {
+        "origins": [{"lat": lat, "lng": lon} for lat, lon in origins],
+        "destinations": [{"lat": lat, "lng": lon} for lat, lon in destinations],
+        # world 區域只能搭配預先計算的 profile；自訂 transportMode 需使用有範圍的區域
+        "regionDefinition": {"type": "autoCircle"},
+        "transportMode": transport_mode,
+        "matrixAttributes": ["travelTimes"],
+    }
+    response = transport.post(url, json=body)
+
+    if response.status_code == 200:
+        matrix = response.json()["matrix"]
+        travel_times = matrix["travelTimes"]
+        error_codes = matrix.get("errorCodes") or [0] * len(travel_times)
+        columns = len(destinations)
+        block = [[travel_times[i * columns + j] if error_codes[i * columns + j] == 0 else None
+                  for j in range(columns)] for i in range(len(origins))]
+        travel_time_matrix_cache.set(key, block)
+        return block
+    else:
+        print(f"請求失敗，狀態碼: {response.status_code}")
+        return None
+
+# 以 HERE Matrix Routing 批次取得 n×n 行車時間矩陣（秒），超過單次請求上限時分塊並同時查詢
+# 無法抵達的路段以直線距離估計；任一區塊請求失敗時回傳 None
+def get_travel_time_matrix(locations, transport_mode="car", max_workers=ROUTE_LEG_CONCURRENCY):
+    points = [(loc[1], loc[2]) for loc in locations]
+    n = len(points)
+    blocks = [(i, j) for i in range(0, n, MATRIX_MAX_ORIGINS) for j in range(0, n, MATRIX_MAX_DESTINATIONS)]
+    if not blocks:
+        return []
+
+    def fetch(block):
+        i, j = block
+        return get_travel_time_block(points[i:i + MATRIX_MAX_ORIGINS], points[j:j + MATRIX_MAX_DESTINATIONS], transport_mode)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(blocks))) as executor:
+        results = list(executor.map(tracing.propagate(fetch), blocks))
+    if any(result is None for result in results):
+        return None
+
+    matrix = [[0.0] * n for _ in range(n)]
+    for (i, j), block in zip(blocks, results):
+        for di, row in enumerate(block):
+            for dj, value in enumerate(row):
+                a, b = i + di, j + dj
+                if a == b:
+                    continue
+                if value is None:
+                    value = haversine(*points[a], *points[b]) / MATRIX_FALLBACK_SPEED_KMH * 3600
+                matrix[a][b] = float(value)
+    return np.array(matrix) if np is not None else matrix
+
+# 生成路徑地圖（legs 為 get_route_legs 的結果，未提供時自行查詢）
+@tracing.traced()
+def get_map(locations, transMode="car", legs=None):
+    if legs is None:
+        legs = get_route_legs(locations, transMode)
+
     all_coordinates = []
     
-    # 遍歷所有相鄰地點並獲取路徑
-    for i in range(len(locations) - 1):
-        origin = f"{locations[i][1]},{locations[i][2]}"  # 起點
-        destination = f"{locations[i+1][1]},{locations[i+1][2]}"  # 終點
-        
-        # 設置移動方式
-        transportMode = transMode
-        
-        # 構建請求 URL
-        url = f"https://router.hereapi.com/v8/routes?transportMode={transportMode}&origin={origin}&destination={destination}&return=summary,polyline&apiKey={api_key}"
-        
-        # 發送 GET 請求
-        response = requests.get(url)
-        
-        # 檢查請求是否成功
-        if response.status_code == 200:
-            route_data = response.json()
-            
-            # 提取路徑的 polyline
-            route_info = route_data['routes'][0]['sections'][0]
-            polyline_data = route_info.get('polyline')
-            
-            # 解碼 polyline
-            coordinates = fp.decode(polyline_data)
-            
-            # 假設我們只選擇寬度大於 10 米的道路
-            filtered_coordinates = [coord for coord in coordinates if coord[0] > 10]
-            all_coordinates.extend(filtered_coordinates)  # 添加到總路徑中
-        else:
-            print(f"請求失敗，狀態碼: {response.status_code}")
+    # 遍歷所有相鄰地點的路段
+    for leg in legs:
+        if leg is None:
             return None
+
+        # 解碼 polyline
+        coordinates = fp.decode(leg["polyline"])
+
+        # 假設我們只選擇寬度大於 10 米的道路
+        filtered_coordinates = [coord for coord in coordinates if coord[0] > 10]
+        all_coordinates.extend(filtered_coordinates)  # 添加到總路徑中
     
     # 設定起點座標作為地圖的中心
     start_coords = all_coordinates[0]
@@ -257,200 +845,361 @@ def get_map(locations, transMode="car"):
     # print("路徑地圖完成!")
     return m
 
-# 尋找地點附近的餐廳
-def find_nearby_restaurant(lat, lon, radius=300, limit=1, max_radius=10000, step=300):
-    api_key = API_KEY_2
-    
-    places_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-    selected_places = []
-    
-    while radius <= max_radius:
-        params = {
-            "location": f"{lat},{lon}",
-            "radius": radius,
-            "type": "restaurant",
-            "key": api_key,
-            "language": "zh-TW"  # 使用繁體中文返回地點名稱與地址
-        }
-        
-        try:
-            # 發送 API 請求
-            response = requests.get(places_url, params=params)
-            response.raise_for_status()
-            data = response.json()
-
-            # 檢查是否有結果
-            if "results" in data and data["results"]:
-                for result in data["results"]:
-                    name = result.get("name", "Unnamed")  # 獲取地點名稱
-                    place_lat = result["geometry"]["location"]["lat"]
-                    place_lon = result["geometry"]["location"]["lng"]
-                    address = result.get("vicinity", "地址未知")  # 簡單地址（附近地點）
-
-                    # 過濾未命名地點
-                    if name != "Unnamed":
-                        selected_places.append([name, place_lat, place_lon, address])
-
-                # 若找到足夠數量的地點，停止搜尋
-                if len(selected_places) >= limit:
-                    break
+# 附近地點搜尋的半徑序列：每次增加的幅度加倍（radius, radius+step, radius+3step, ...），最多 O(log) 次請求
+def search_radii(radius, max_radius, step):
+    increment = step
+    while radius < max_radius:
+        yield radius
+        radius += increment
+        increment *= 2
+    yield max_radius
 
-        except requests.exceptions.RequestException as e:
-            print(f"請求失敗: {e}")
-            return []
-        except KeyError as e:
-            print(f"數據解析失敗: {e}")
-            return []
+# Geohash 編碼，用於附近地點結果的網格快取
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash_encode(lat, lon, precision=NEARBY_GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    bits, bit_count, even, code = 0, 0, True, []
+    while len(code) < precision:
+        value, value_range = (lon, lon_range) if even else (lat, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            value_range[0] = mid
+        else:
+            bits = bits * 2
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            code.append(GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    # 回傳編碼與網格中心點
+    return "".join(code), (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+# 記錄每次附近地點搜尋發出的請求數
+def record_nearby_lookup(category, requests_made, cache_hits):
+    with nearby_stats_lock:
+        nearby_stats["lookups"] += 1
+        nearby_stats["requests"] += requests_made
+        nearby_stats["cache_hits"] += cache_hits
+        nearby_stats["max_requests"] = max(nearby_stats["max_requests"], requests_made)
+        nearby_stats["last"] = {"category": category, "requests": requests_made, "cache_hits": cache_hits}
+
+# 回傳附近地點搜尋的請求數統計（含平均每次搜尋的請求數）
+def nearby_search_stats():
+    with nearby_stats_lock:
+        stats = dict(nearby_stats)
+    stats["requests_per_lookup"] = stats["requests"] / stats["lookups"] if stats["lookups"] else 0.0
+    return stats
 
-        # 擴大搜尋範圍
-        radius += step
+# geohash 網格中心點到網格角落的距離（公尺，無條件進位）
+def geohash_cell_radius(cell_lat, cell_lon, precision=NEARBY_GEOHASH_PRECISION):
+    lat_bits, lon_bits = (5 * precision) // 2, (5 * precision + 1) // 2
+    half_lat, half_lon = 90 / 2 ** lat_bits, 180 / 2 ** lon_bits
+    return math.ceil(haversine(cell_lat, cell_lon, cell_lat + half_lat, cell_lon + half_lon) * 1000)
+
+# 逐步擴大半徑搜尋附近地點，每個（類別、geohash 網格、半徑）的結果都會快取供附近的查詢重複使用
+# 快取的是以網格中心點、半徑加上網格半對角線查詢的結果，涵蓋網格內任一點的搜尋範圍，再依實際座標過濾距離
+# fetch(lat, lon, radius) 回傳該半徑內的地點串列；請求失敗時回傳 None
+def search_nearby(category, lat, lon, radius, limit, max_radius, step, fetch):
+    cell, cell_lat, cell_lon = geohash_encode(lat, lon)
+    padding = geohash_cell_radius(cell_lat, cell_lon)
+    requests_made = cache_hits = 0
+    places = []
+
+    for search_radius in search_radii(radius, max_radius, step):
+        key = f"{category}:{cell}:{search_radius + padding}"
+        cell_places = nearby_cache.get(key)
+        if cell_places is MISSING:
+            requests_made += 1
+            cell_places = fetch(cell_lat, cell_lon, search_radius + padding)
+            if cell_places is None:
+                record_nearby_lookup(category, requests_made, cache_hits)
+                return []
+            nearby_cache.set(key, cell_places)
+        else:
+            cache_hits += 1
+
+        # 只保留實際座標半徑內的地點，由近到遠排列
+        distances = [(haversine(lat, lon, place[1], place[2]) * 1000, place) for place in cell_places]
+        places = [place for distance, place in sorted(distances, key=lambda item: item[0]) if distance <= search_radius]
+
+        # 若找到足夠數量的地點，停止搜尋
+        if len(places) >= limit:
+            break
 
-    if selected_places:
+    record_nearby_lookup(category, requests_made, cache_hits)
+    if places:
         # 隨機選擇地點
-        return random.sample(selected_places, k=min(limit, len(selected_places)))
+        return [place[:] for place in random.sample(places, k=min(limit, len(places)))]
 
     # 若超過最大範圍仍無結果，返回提示
     print("未能找到符合條件的地點。")
     return []
 
+# 從離線 POI 索引尋找附近地點，結果與線上逐步擴大半徑的搜尋一致：
+# 在「包含 limit 個地點的最小搜尋半徑」內隨機選擇；索引不存在或查無結果時回傳空串列
+def find_nearby_from_index(category, lat, lon, radius=300, limit=1, max_radius=10000, step=300):
+    index = load_poi_index(POI_INDEX_PATH) if POI_INDEX_PATH else None
+    if index is None:
+        return []
+
+    nearest = index.nearest(lat, lon, k=limit, category=category, max_radius=max_radius)
+    if not nearest:
+        return []
+    farthest = nearest[-1][0]
+    reach = next(r for r in search_radii(radius, max_radius, step) if r >= farthest or r >= max_radius)
+    candidates = [place for distance, place in index.within(lat, lon, reach, category)]
+    return random.sample(candidates, k=min(limit, len(candidates)))
+
+# 以 Google Places 查詢半徑內的餐廳
+def fetch_restaurants(lat, lon, radius):
+    api_key = API_KEY_2
+    places_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+    params = {
+        "location": f"{lat},{lon}",
+        "radius": radius,
+        "type": "restaurant",
+        "key": api_key,
+        "language": "zh-TW"  # 使用繁體中文返回地點名稱與地址
+    }
+
+    try:
+        # 發送 API 請求
+        response = transport.get(places_url, params=params)
+        response.raise_for_status()
+        data = response.json()
+
+        places = []
+        for result in data.get("results", []):
+            name = result.get("name", "Unnamed")  # 獲取地點名稱
+            place_lat = result["geometry"]["location"]["lat"]
+            place_lon = result["geometry"]["location"]["lng"]
+            address = result.get("vicinity", "地址未知")  # 簡單地址（附近地點）
+
+            # 過濾未命名地點
+            if name != "Unnamed":
+                places.append([name, place_lat, place_lon, address])
+        return places
+
+    except requests.exceptions.RequestException as e:
+        print(f"請求失敗: {e}")
+        return None
+    except KeyError as e:
+        print(f"數據解析失敗: {e}")
+        return None
+
+# 以 Overpass 查詢半徑內的旅館（地址留空，選定後再查詢）
+def fetch_hotels(lat, lon, radius):
+    overpass_url = "http://overpass-api.de/api/interpreter"
+    query = f"""
+        [out:json];
+        node["tourism"="hotel"](around:{radius},{lat},{lon});
+        out;
+    """
+
+    try:
+        # 發送 API 請求
+        response = transport.get(overpass_url, params={'data': query})
+        response.raise_for_status()  # 如果請求失敗會拋出 HTTPError
+        data = response.json()
+
+        # 收集地點數據
+        places = []
+        for element in data.get('elements', []):
+            name = element.get("tags", {}).get("name", "Unnamed")
+            if name != "Unnamed":  # 過濾掉未命名的地點
+                places.append([name, element.get("lat"), element.get("lon"), ""])
+        return places
+
+    except requests.exceptions.RequestException as e:
+        print(f"請求失敗: {e}")
+        return None
+    except KeyError as e:
+        print(f"數據解析失敗: {e}")
+        return None
+
+# 尋找地點附近的餐廳
+def find_nearby_restaurant(lat, lon, radius=300, limit=1, max_radius=10000, step=300):
+    # 優先使用離線索引
+    places = find_nearby_from_index("restaurant", lat, lon, radius, limit, max_radius, step)
+    if places:
+        for place in places:
+            place[3] = place[3] or "地址未知"
+        return places
+
+    return search_nearby("restaurant", lat, lon, radius, limit, max_radius, step, fetch_restaurants)
+
 # 尋找地點附近的旅館
 def find_nearby_hotel(lat, lon, radius=300, limit=1, max_radius=10000, step=300):
+    # 優先使用離線索引，否則使用 Overpass
+    places = find_nearby_from_index("hotel", lat, lon, radius, limit, max_radius, step)
+    if not places:
+        places = search_nearby("hotel", lat, lon, radius, limit, max_radius, step, fetch_hotels)
+
+    # 為隨機選擇的地點查詢地址
+    for place in places:
+        place[3] = place[3] or get_address(place[1], place[2])
+    return places
+
+
+# 以一次 Overpass 聯集查詢同時尋找整趟行程每一天的旅館（anchors 為每天最後一個景點的座標）
+# 旅館地址優先使用 OSM 的 addr:* 標籤，缺少時才反向查詢；回傳與 anchors 順序一致的旅館串列
+# 聯集查詢失敗時，尚未查到的日期改用 find_nearby_hotel 逐日查詢；max_radius 內查無旅館的日期為空串列
+@tracing.traced()
+def find_hotels_for_trip(anchors, radius=300, limit=1, max_radius=10000, step=300):
     overpass_url = "http://overpass-api.de/api/interpreter"
+    results = [find_nearby_from_index("hotel", lat, lon, radius, limit, max_radius, step) for lat, lon in anchors]
+    pending = [i for i, places in enumerate(results) if not places]
+    failed = []
+    requests_made = 0
 
-    while radius <= max_radius:
-        query = f"""
-            [out:json];
-            node["tourism"="hotel"](around:{radius},{lat},{lon});
-            out;
-        """
+    for search_radius in search_radii(radius, max_radius, step):
+        if not pending:
+            break
+        # 只查詢尚未找到足夠旅館的日期
+        query = "[out:json];(" + "".join(
+            f'node["tourism"="hotel"](around:{search_radius},{anchors[i][0]},{anchors[i][1]});' for i in pending
+        ) + ");out;"
 
         try:
-            # 發送 API 請求
-            response = requests.get(overpass_url, params={'data': query})
-            response.raise_for_status()  # 如果請求失敗會拋出 HTTPError
-            data = response.json()
-
-            # 收集地點數據
-            all_places = []
-            for element in data.get('elements', []):
-                name = element.get("tags", {}).get("name", "Unnamed")
-                lat = element.get("lat")
-                lon = element.get("lon")
-
-                if name != "Unnamed":  # 過濾掉未命名的地點
-                    all_places.append([name, lat, lon, ""])
-
-            # 若已收集到足夠數量的地點，停止搜尋
-            if len(all_places) >= limit:
-                break
-
+            requests_made += 1
+            response = transport.get(overpass_url, params={'data': query})
+            response.raise_for_status()
+            elements = response.json().get('elements', [])
         except requests.exceptions.RequestException as e:
             print(f"請求失敗: {e}")
-            return []
-        except KeyError as e:
-            print(f"數據解析失敗: {e}")
-            return []
+            failed = pending
+            break
 
-        # 擴大搜尋半徑
-        radius += step
+        hotels = [[element["tags"]["name"], element["lat"], element["lon"], format_osm_address(element["tags"])]
+                  for element in elements if element.get("tags", {}).get("name")]
 
-    if all_places:
-        # 隨機選擇地點
-        selected_places = random.sample(all_places, k=min(limit, len(all_places)))
-        # 為隨機選擇的地點查詢地址
-        for place in selected_places:
-            name, lat, lon, _ = place
-            place[3] = get_address(lat, lon)  # 查詢地址並更新列表
-        return selected_places
+        # 在本地將旅館分配給半徑內的每一天
+        still_pending = []
+        for i in pending:
+            lat, lon = anchors[i]
+            nearby = [hotel for hotel in hotels if haversine(lat, lon, hotel[1], hotel[2]) * 1000 <= search_radius]
+            if len(nearby) >= limit or search_radius >= max_radius:
+                results[i] = [hotel[:] for hotel in random.sample(nearby, k=min(limit, len(nearby)))]
+            else:
+                still_pending.append(i)
+        pending = still_pending
 
-    # 若超過最大範圍仍無結果，返回提示
-    print("未能找到符合條件的地點。")
-    return []
+    record_nearby_lookup("hotel_batch", requests_made, 0)
 
+    # 聯集查詢失敗的日期改為逐日查詢；已查到 max_radius 仍無旅館的日期不再重查
+    for i in failed:
+        results[i] = find_nearby_hotel(anchors[i][0], anchors[i][1], radius, limit, max_radius, step)
 
-# 將景點陣列增加餐廳和旅館
-def add_restaurant_and_hotel(group):
-    loc1 = group[0]
-    loc2 = group[1]
-    loc3 = group[2]
+    for i, places in enumerate(results):
+        if i in failed:
+            continue
+        for place in places:
+            place[3] = place[3] or get_address(place[1], place[2])
+    return results
 
-    loc_name1, lat1, lon1 = loc1[0], loc1[1], loc1[2]
-    loc_name2, lat2, lon2 = loc2[0], loc2[1], loc2[2]
+# 將景點陣列增加餐廳和旅館（hotel 為預先查詢好的旅館串列，未提供時自行查詢）
+# 午餐安排在第一、二個景點之間，晚餐與旅館在最後一個景點附近；景點不足 3 個的日期同樣適用
+@tracing.traced()
+def add_restaurant_and_hotel(group, hotel=None):
+    first, second, last = group[0], group[min(1, len(group) - 1)], group[-1]
 
-    midpoint_lat, midpoint_lon = get_midpoint(lat1, lon1, lat2, lon2)
+    midpoint_lat, midpoint_lon = get_midpoint(first[1], first[2], second[1], second[2])
     lunch = find_nearby_restaurant(midpoint_lat, midpoint_lon)
-    
-    group.insert(1, lunch[0])
+    # 找不到餐廳或旅館時以查詢位置作為佔位地點，避免整趟行程失敗
+    group.insert(1, lunch[0] if lunch else ["未找到餐廳", midpoint_lat, midpoint_lon, ""])
 
-    dinner = find_nearby_restaurant(loc3[1], loc3[2])
-    group.append(dinner[0])
+    dinner = find_nearby_restaurant(last[1], last[2])
+    group.append(dinner[0] if dinner else ["未找到餐廳", last[1], last[2], ""])
 
-    hotel = find_nearby_hotel(loc3[1], loc3[2])
-    group.append(hotel[0])
+    if hotel is None:
+        hotel = find_nearby_hotel(last[1], last[2])
+    group.append(hotel[0] if hotel else ["未找到旅館", last[1], last[2], ""])
 
     return group
 
-# 獲取估計移動時間
-def get_travel_times(locations, transport_mode="car", error=0):
-    api_key = API_KEY_1
-    
+# 獲取估計移動時間（legs 為 get_route_legs 的結果，未提供時自行查詢）
+@tracing.traced()
+def get_travel_times(locations, transport_mode="car", error=0, legs=None):
+    if legs is None:
+        legs = get_route_legs(locations, transport_mode)
+
     travel_times = []
 
     # 遍歷每兩個連續地點
-    for i in range(len(locations) - 1):
-        origin = f"{locations[i][1]},{locations[i][2]}"
-        destination = f"{locations[i + 1][1]},{locations[i + 1][2]}"
-
-        # 構建請求 URL
-        url = (
-            f"https://router.hereapi.com/v8/routes"
-            f"?transportMode={transport_mode}"
-            f"&origin={origin}"
-            f"&destination={destination}"
-            f"&return=summary"
-            f"&apiKey={api_key}"
-        )
-
-        # 發送 GET 請求
-        response = requests.get(url)
-
-        if response.status_code == 200:
-            # 解析 JSON 回應
-            route_data = response.json()
-            duration = route_data['routes'][0]['sections'][0]['summary']['duration']
-            travel_times.append(duration // 60 + error)  # 將秒數轉換為分鐘
+    for leg in legs:
+        if leg is not None:
+            travel_times.append(leg["duration"] // 60 + error)  # 將秒數轉換為分鐘
         else:
-            print(f"請求失敗，狀態碼: {response.status_code}")
             travel_times.append(None)  # 如果失敗，填入 None
 
     return travel_times
 
 
-def generate_route(attractions):
+# 完成一天的行程：加入餐廳和旅館，查詢路段後計算移動時間並生成地圖
+@tracing.traced()
+def build_day(group, hotel=None):
+    group = add_restaurant_and_hotel(group, hotel)
+    # 每個路段只查詢一次，同時用於移動時間與地圖
+    legs = get_route_legs(group, "car")
+    travel_times = get_travel_times(group, "car", error=10, legs=legs)
+    route_map = get_map(group, "car", legs=legs)
+    return route_map, group, travel_times
+
+# 逐日生成行程的產生器：路徑求解後同時處理各天，依天數順序在每天完成時立即回傳 (路線圖, 地點, 移動時間)
+# 預設先將景點分群到各天再分別求解（cluster_route）：每天的景點彼此相近，天數越多差距越大
+# cluster_days=False 時改為求整條最佳路徑後每 3 個切成一天；time_budget_ms 只用於這種方式，
+# 為路徑求解的時間上限（毫秒），None 表示使用固定迭代次數的模擬退火
+# use_travel_time_matrix=True 時以批次查詢的實際行車時間取代直線距離作為路徑成本
+def iter_route(attractions, time_budget_ms=None, use_travel_time_matrix=False, max_workers=ROUTE_DAY_CONCURRENCY, cluster_days=True):
+    distance_matrix = None
+    if use_travel_time_matrix:
+        print("正在查詢行車時間矩陣...")
+        distance_matrix = get_travel_time_matrix(attractions, "car")
+        if distance_matrix is None:
+            print("行車時間矩陣查詢失敗，改用直線距離。")
+
     # 尋找最佳路徑
     print("地點資訊已獲取，正在計算最佳路徑...")
-    sorted_locations = simulated_annealing(attractions)
-    
-    # 將景點分組
-    grouped_locations = split_array(sorted_locations, 3)
-    
-    # 為每組景點添加餐廳和旅館
-    print("正在尋找餐廳和旅館...")
-    grouped_locations = [add_restaurant_and_hotel(group) for group in grouped_locations]
-    
-    # 獲取移動時間
-    print("正在計算交通時間...")
-    travel_times = [get_travel_times(group, "car", error=10) for group in grouped_locations]
-    
-    # 創建地圖
-    print("正在生成路線圖...")
-    route_map = [get_map(group, "car") for group in grouped_locations]
+    if cluster_days:
+        grouped_locations = cluster_route(attractions, 3, distance_matrix=distance_matrix)
+    else:
+        sorted_locations = solve_route(attractions, time_budget_ms=time_budget_ms, distance_matrix=distance_matrix)
+        # 將景點分組
+        grouped_locations = split_array(sorted_locations, 3)
+    if not grouped_locations:
+        return
+
+    # 所有日期的旅館以一次查詢取得
+    print("正在尋找旅館...")
+    hotels = find_hotels_for_trip([(group[-1][1], group[-1][2]) for group in grouped_locations])
+
+    # 各天互不相依，同時處理；提前關閉產生器時取消尚未開始的日期
+    print("正在尋找餐廳、查詢路段並生成路線圖...")
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(grouped_locations)))
+    try:
+        futures = [executor.submit(tracing.propagate(build_day), group, hotel) for group, hotel in zip(grouped_locations, hotels)]
+        for i, future in enumerate(futures):
+            day = future.result()
+            print(f"第{i + 1}天行程已生成！")
+            yield day
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# cluster_days、time_budget_ms 與 use_travel_time_matrix 見 iter_route
+@tracing.traced()
+def generate_route(attractions, time_budget_ms=None, use_travel_time_matrix=False, cluster_days=True):
+    days = list(iter_route(attractions, time_budget_ms=time_budget_ms, use_travel_time_matrix=use_travel_time_matrix, cluster_days=cluster_days))
+    route_map = [day[0] for day in days]
+    grouped_locations = [day[1] for day in days]
+    travel_times = [day[2] for day in days]
     
     print("旅遊行程與路線圖已生成！")
     
     return route_map, grouped_locations, travel_times
 
-
 # In[ ]:
 
 
@@ -1,76 +1,163 @@
-from llm import duckchat_response
+from llm import routed_response, cached_llm_response, gather_responses
 from datetime import datetime, timedelta
 from IPython.display import display, HTML
 import pandas as pd
+import json
 from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter
 import os
+import tracing
 
 # 模擬 location_description 函式
+def location_description_prompt(name):
+    return f"請輸出一篇大約五十字的{name}的景點介紹，不用前言只需本文"
+
 def location_description(name):
-    prompt = f"請輸出一篇大約五十字的{name}的景點介紹，不用前言只需本文"
-    brief_intro = duckchat_response(prompt)       
+    prompt = location_description_prompt(name)
+    brief_intro = cached_llm_response(prompt, routed_response)
     
     return brief_intro
 
+def schedule_brief_prompt(locations):
+    return f"請輸出一篇大約兩百字的行程簡介將各景點依造訪時間串聯，{locations}為行程中需造訪的景點。"
+
 def schedule_brief(locations):
-    prompt = f"請輸出一篇大約兩百字的行程簡介將各景點依造訪時間串聯，{locations}為行程中需造訪的景點。"
+    prompt = schedule_brief_prompt(locations)
 
-    try:
-        duckchat_response(prompt)[duckchat_response(prompt).find(":")+1:].strip() 
-    except Exception as e:
-        brief_schedule = duckchat_response(prompt)
-    else:
-        brief_schedule = duckchat_response(prompt)[duckchat_response(prompt).find(":")+1:].strip() 
+    # 只呼叫一次模型，並去掉「:」之前的前言
+    response = cached_llm_response(prompt, routed_response)
+    brief_schedule = response[response.find(":")+1:].strip()
 
     return brief_schedule
 
+def parse_json_response(response):
+    """
+    從模型回應中取出 JSON 物件（忽略前後的說明文字或 ``` 標記）。
+
+    Args:
+        response (str): 模型的回應。
+
+    Returns:
+        dict: 解析後的物件，無法解析時回傳空字典。
+    """
+    start, end = response.find("{"), response.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def parse_day_descriptions(day, locations):
+    """
+    驗證並取出單日的景點簡介與行程摘要，格式為 {"spots": [{"name": 名稱, "description": 簡介}], "summary": 摘要}。
+
+    Args:
+        day (dict): 模型回傳的單日資料。
+        locations (list): 當日的地點資料。
+
+    Returns:
+        tuple: (各地點的簡介串列，缺少者為 None, 行程摘要，缺少時為 None)。
+    """
+    spots = day.get("spots") if isinstance(day, dict) else None
+    by_name = dict()
+    for spot in spots if isinstance(spots, list) else []:
+        if isinstance(spot, dict) and isinstance(spot.get("name"), str) and isinstance(spot.get("description"), str) and spot["description"].strip():
+            by_name.setdefault(spot["name"].strip(), spot["description"].strip())
+    descriptions = [by_name.get(str(location[0]).strip()) for location in locations]
+    summary = day.get("summary") if isinstance(day, dict) else None
+    summary = summary.strip() if isinstance(summary, str) and summary.strip() else None
+    return descriptions, summary
+
+def describe_trip(grouped_locations):
+    """
+    以一次模型呼叫取得整趟行程（或單日）所有地點的簡介與每日行程摘要，缺少的項目再個別補上。
+
+    Args:
+        grouped_locations (list): 每天的地點資料串列，例如 generate_route 回傳的 grouped_locations。
+
+    Returns:
+        list: 每天的 (各地點簡介串列, 行程摘要)。
+    """
+    days = [[str(location[0]) for location in locations] for locations in grouped_locations]
+    prompt = f"""以下是旅遊行程中每一天依造訪順序排列的地點：{json.dumps(days, ensure_ascii=False)}
+請只輸出一個 JSON 物件，不要其他文字，格式如下：
+{{"days": [{{"spots": [{{"name": "地點名稱（與輸入完全相同）", "description": "大約五十字的景點介紹，不用前言只需本文"}}], "summary": "大約兩百字的行程簡介，將各景點依造訪時間串聯"}}]}}
+days 的順序與數量必須與輸入相同，每一天都要包含該天的所有地點。"""
+
+    # 只接受可解析為 {"days": [...]} 的回應，格式錯誤或被截斷的回應不會勝出也不會被快取
+    def is_valid(response):
+        return isinstance(response, str) and isinstance(parse_json_response(response).get("days"), list)
+
+    try:
+        data = parse_json_response(cached_llm_response(prompt, routed_response, validate=is_valid))
+    except ValueError as e:
+        # 沒有模型回傳有效的 JSON，改為個別補上所有項目
+        print(f"行程簡介批次產生失敗: {e}")
+        data = {}
+    returned_days = data.get("days") if isinstance(data.get("days"), list) else []
+
+    results = [parse_day_descriptions(returned_days[i] if i < len(returned_days) else {}, locations) for i, locations in enumerate(grouped_locations)]
+
+    # 只為缺少的項目個別呼叫模型，並行送出
+    missing_descriptions = [(i, j) for i, (descriptions, _) in enumerate(results) for j, description in enumerate(descriptions) if description is None]
+    missing_briefs = [i for i, (_, summary) in enumerate(results) if summary is None]
+    prompts = [location_description_prompt(grouped_locations[i][j]) for i, j in missing_descriptions]
+    prompts += [schedule_brief_prompt(grouped_locations[i]) for i in missing_briefs]
+    responses = gather_responses(prompts, routed_response, cached = True) if prompts else []
+
+    for (i, j), response in zip(missing_descriptions, responses):
+        results[i][0][j] = response
+    for i, response in zip(missing_briefs, responses[len(missing_descriptions):]):
+        results[i] = (results[i][0], response[response.find(":")+1:].strip())
+    return results
+
 def calculate_stay_times(travel_times):
     """
-    根據地點間的移動時間計算地點1~6的逗留時間，並以字串形式返回。
+    根據地點間的移動時間計算當天各地點的逗留時間，並以字串形式返回。
+    當天地點依序為：景點、午餐、0~2個景點、晚餐、旅館；景點不足 3 個的日期只有 4 或 5 個地點。
 
     Args:
-        travel_times (list): 長度為5的列表，表示地點1到地點6間的移動時間（分鐘）。
+        travel_times (list): 長度為3~5的列表，表示相鄰地點間的移動時間（分鐘）。
 
     Returns:
-        list: 地點1~6的逗留時間段字串，格式為 "09:00~11:30"。
+        list: 各地點的逗留時間段字串，格式為 "09:00~11:30"。
     """
-    if len(travel_times) != 5:
-        raise ValueError("移動時間列表必須包含5個元素，表示地點1到地點6間的移動時間。")
+    if not 3 <= len(travel_times) <= 5:
+        raise ValueError("移動時間列表必須包含3~5個元素，表示當天4~6個地點間的移動時間。")
+    afternoon_spots = len(travel_times) - 3  # 午餐與晚餐之間的景點數
 
     # 初始條件
     start_location_1 = datetime.strptime("09:00", "%H:%M")
-    arrive_location_2_fixed = datetime.strptime("12:00", "%H:%M")
-    leave_location_2 = arrive_location_2_fixed + timedelta(hours=1)  # 地點2固定逗留1小時
-    arrive_location_5_fixed = datetime.strptime("18:00", "%H:%M")  # 地點5的到達時間固定為18:00
-    stay_duration_location_5 = timedelta(hours=1)  # 地點5固定逗留1小時
-
-    # 計算地點3與地點4的中點時間
-    midpoint_location_3_4 = leave_location_2 + (arrive_location_5_fixed - leave_location_2) / 2
+    arrive_lunch_fixed = datetime.strptime("12:00", "%H:%M")
+    leave_lunch = arrive_lunch_fixed + timedelta(hours=1)  # 午餐固定逗留1小時
+    arrive_dinner_fixed = datetime.strptime("18:00", "%H:%M")  # 晚餐的到達時間固定為18:00
+    stay_duration_dinner = timedelta(hours=1)  # 晚餐固定逗留1小時
 
     # 地點1的離開時間
-    leave_location_1 = arrive_location_2_fixed - timedelta(minutes=travel_times[0])
+    leave_location_1 = arrive_lunch_fixed - timedelta(minutes=travel_times[0])
     stay_times = [f"{start_location_1.strftime('%H:%M')}~{leave_location_1.strftime('%H:%M')}"]
 
-    # 地點2的逗留時間
-    stay_times.append(f"{arrive_location_2_fixed.strftime('%H:%M')}~{leave_location_2.strftime('%H:%M')}")
+    # 午餐的逗留時間
+    stay_times.append(f"{arrive_lunch_fixed.strftime('%H:%M')}~{leave_lunch.strftime('%H:%M')}")
 
-    # 地點3的逗留時間
-    arrive_location_3 = leave_location_2 + timedelta(minutes=travel_times[1])
-    leave_location_3 = midpoint_location_3_4 - timedelta(minutes=travel_times[2] // 2)
-    stay_times.append(f"{arrive_location_3.strftime('%H:%M')}~{leave_location_3.strftime('%H:%M')}")
+    # 午餐與晚餐之間的景點平分這段時間，相鄰兩個景點在分界時間前後各移動一半的時間
+    if afternoon_spots:
+        slot = (arrive_dinner_fixed - leave_lunch) / afternoon_spots
+    for j in range(afternoon_spots):
+        arrive_offset = timedelta(minutes=travel_times[1] if j == 0 else travel_times[1 + j] // 2)
+        leave_offset = timedelta(minutes=travel_times[2 + j] if j == afternoon_spots - 1 else travel_times[2 + j] // 2)
+        arrive_location = leave_lunch + slot * j + arrive_offset
+        leave_location = leave_lunch + slot * (j + 1) - leave_offset
+        stay_times.append(f"{arrive_location.strftime('%H:%M')}~{leave_location.strftime('%H:%M')}")
 
-    # 地點4的逗留時間
-    arrive_location_4 = midpoint_location_3_4 + timedelta(minutes=travel_times[2] // 2)
-    leave_location_4 = arrive_location_5_fixed - timedelta(minutes=travel_times[3])
-    stay_times.append(f"{arrive_location_4.strftime('%H:%M')}~{leave_location_4.strftime('%H:%M')}")
+    # 晚餐的逗留時間
+    stay_times.append(f"{arrive_dinner_fixed.strftime('%H:%M')}~{(arrive_dinner_fixed + stay_duration_dinner).strftime('%H:%M')}")
 
-    # 地點5的逗留時間
-    stay_times.append(f"{arrive_location_5_fixed.strftime('%H:%M')}~{(arrive_location_5_fixed + stay_duration_location_5).strftime('%H:%M')}")
-
-    # 地點6的到達時間
-    arrive_location_6 = arrive_location_5_fixed + stay_duration_location_5 + timedelta(minutes=travel_times[4])
-    stay_times.append(f"{arrive_location_6.strftime('%H:%M')}~")
+    # 旅館的到達時間
+    arrive_hotel = arrive_dinner_fixed + stay_duration_dinner + timedelta(minutes=travel_times[-1])
+    stay_times.append(f"{arrive_hotel.strftime('%H:%M')}~")
 
     return stay_times
 
@@ -104,26 +191,32 @@ def set_column_widths(excel_file, column_widths):
     
     workbook.save(excel_file)
     
-def create_travel_schedule(locations,travel_times):
+@tracing.traced()
+def create_travel_schedule(locations,travel_times,descriptions=None,brief=None,batch=True):
     """
-    接收6個地點名稱，生成行程表，輸出至 Excel 並在終端顯示。
+    接收當天的地點（通常為6個，景點不足 3 個的日期為4或5個），生成行程表，輸出至 Excel 並在終端顯示。
     
     Args:
-        locations (list): 包含6個地點名稱的列表。
+        locations (list): 包含4~6個地點名稱的列表。
+        descriptions (list): 預先產生的各地點簡介（例如 describe_trip 的結果），未提供時自動產生。
+        brief (str): 預先產生的行程摘要，未提供時自動產生。
+        batch (bool): 自動產生時是否以一次模型呼叫取得當日所有簡介與摘要，False 則逐一呼叫。
     """
-    if len(locations) != 6:
-        raise ValueError("請確保輸入的地點數量正好是 6 個。")
+    if not 4 <= len(locations) <= 6:
+        raise ValueError("請確保輸入的地點數量為 4~6 個。")
 
     # 初始化一個空的列表來存放地點資訊
     schedule = []
-    schedulebrief = schedule_brief(locations)
+    if descriptions is None and batch:
+        descriptions, batch_brief = describe_trip([locations])[0]
+        brief = brief or batch_brief
+    schedulebrief = brief if brief is not None else schedule_brief(locations)
+    # 把travel times計算後存入time_period
+    time_periods = calculate_stay_times(travel_times)
 
     for i, name in enumerate(locations):
         # 使用 location_description 為所有地點生成簡介存入description
-        description = location_description(name)
-        # 把travel times計算後存入time_period
-        time_periods = calculate_stay_times(travel_times)
-        
+        description = descriptions[i] if descriptions is not None else location_description(name)
         
         # 將地點資訊加入行程表
         schedule.append({"時間": time_periods[i], "地點名稱": f"{name[0]}：{name[3]}", "景點簡介": description})
@@ -0,0 +1,202 @@
+import json
+import math
+import sys
+from functools import lru_cache
+try:
+    import numpy as np
+except ImportError:  # 未安裝 numpy 時無法使用離線索引，改用線上 API
+    np = None
+
+# 網格大小（度），約 1 公里
+CELL_SIZE = 0.01
+
+# 支援的 POI 類別與對應的 OSM 標籤
+CATEGORIES = {
+    "restaurant": ("amenity", "restaurant"),
+    "hotel": ("tourism", "hotel"),
+}
+
+# 匯出台灣 POI 用的 Overpass 查詢，結果存成 JSON 後交給 build_poi_index
+OVERPASS_EXPORT_QUERY = """
+[out:json][timeout:900];
+area["ISO3166-1"="TW"][admin_level=2]->.tw;
+(
+  nwr["amenity"="restaurant"](area.tw);
+  nwr["tourism"="hotel"](area.tw);
+);
+out center tags;
+"""
+
+
+def format_osm_address(tags):
+    """Build a Taiwanese address string from OSM `addr:*` tags.
+
+    Args:
+        - tags (dict): The OSM tags of a place.
+
+    Returns:
+        - str: The address, or an empty string if the place has no address tags.
+    """
+    if tags.get("addr:full"):
+        return tags["addr:full"]
+    parts = [tags.get(key, "") for key in ("addr:postcode", "addr:city", "addr:district", "addr:street", "addr:housenumber")]
+    if not tags.get("addr:street") and not tags.get("addr:housenumber"):
+        return ""
+    housenumber = parts[4]
+    if housenumber and not housenumber.endswith("號"):
+        parts[4] = housenumber + "號"
+    return "".join(parts)
+
+
+def build_poi_index(source_path, output_prefix, cell_size=CELL_SIZE):
+    """Build the offline POI index from an Overpass JSON export (see `OVERPASS_EXPORT_QUERY`).
+
+    The index is written as `<prefix>.coords.npy` (lat/lon sorted by grid cell), `<prefix>.categories.npy`,
+    `<prefix>.cells.npy` (the first row of every grid cell) and `<prefix>.json` (names, addresses and grid parameters).
+    The `.npy` files are memory-mapped when loaded.
+
+    Args:
+        - source_path (str): The Overpass JSON export.
+        - output_prefix (str): The path prefix of the index files.
+        - cell_size (float): The grid cell size in degrees.
+
+    Returns:
+        - int: The number of indexed places.
+    """
+    with open(source_path, encoding="utf-8") as file:
+        elements = json.load(file).get("elements", [])
+
+    category_names = list(CATEGORIES)
+    places = []
+    for element in elements:
+        tags = element.get("tags", {})
+        name = tags.get("name")
+        lat = element.get("lat", element.get("center", {}).get("lat"))
+        lon = element.get("lon", element.get("center", {}).get("lon"))
+        if not name or lat is None or lon is None:
+            continue
+        for code, (key, value) in enumerate(CATEGORIES.values()):
+            if tags.get(key) == value:
+                places.append((lat, lon, code, name, format_osm_address(tags)))
+
+    coords = np.array([(place[0], place[1]) for place in places], dtype=np.float64).reshape(-1, 2)
+    if len(places):
+        lat_min, lon_min = coords.min(axis=0)
+        lat_max, lon_max = coords.max(axis=0)
+    else:
+        lat_min = lon_min = lat_max = lon_max = 0.0
+    rows = int((lat_max - lat_min) // cell_size) + 1
+    cols = int((lon_max - lon_min) // cell_size) + 1
+
+    # 依網格編號排序，同一格的 POI 在檔案中連續存放
+    cell_ids = ((coords[:, 0] - lat_min) // cell_size).astype(np.int64) * cols + ((coords[:, 1] - lon_min) // cell_size).astype(np.int64)
+    order = np.argsort(cell_ids, kind="stable")
+    cells = np.searchsorted(cell_ids[order], np.arange(rows * cols + 1)).astype(np.int64)
+
+    np.save(f"{output_prefix}.coords.npy", np.ascontiguousarray(coords[order]))
+    np.save(f"{output_prefix}.categories.npy", np.array([places[i][2] for i in order], dtype=np.uint8))
+    np.save(f"{output_prefix}.cells.npy", cells)
+    with open(f"{output_prefix}.json", "w", encoding="utf-8") as file:
+        json.dump({
+            "cell_size": cell_size,
+            "origin": [float(lat_min), float(lon_min)],
+            "shape": [rows, cols],
+            "categories": category_names,
+            "names": [places[i][3] for i in order],
+            "addresses": [places[i][4] for i in order],
+        }, file, ensure_ascii=False)
+    return len(places)
+
+
+class POIIndex:
+    """Grid index over restaurant and hotel POIs, answering radius and k-nearest queries.
+
+    Args:
+        - prefix (str): The path prefix given to `build_poi_index`.
+    """
+
+    def __init__(self, prefix):
+        self.coords = np.load(f"{prefix}.coords.npy", mmap_mode="r")
+        self.categories = np.load(f"{prefix}.categories.npy", mmap_mode="r")
+        self.cells = np.load(f"{prefix}.cells.npy", mmap_mode="r")
+        with open(f"{prefix}.json", encoding="utf-8") as file:
+            meta = json.load(file)
+        self.cell_size = meta["cell_size"]
+        self.lat_min, self.lon_min = meta["origin"]
+        self.rows, self.cols = meta["shape"]
+        self.category_codes = {name: code for code, name in enumerate(meta["categories"])}
+        self.names = meta["names"]
+        self.addresses = meta["addresses"]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, lat, lon, radius):
+        # 找出半徑範圍所涵蓋的網格，每一列的格子在檔案中是連續的一段
+        dlat = radius / 111320
+        dlon = radius / (111320 * max(math.cos(math.radians(lat)), 1e-6))
+        row_start = max(int((lat - dlat - self.lat_min) // self.cell_size), 0)
+        row_end = min(int((lat + dlat - self.lat_min) // self.cell_size), self.rows - 1)
+        col_start = max(int((lon - dlon - self.lon_min) // self.cell_size), 0)
+        col_end = min(int((lon + dlon - self.lon_min) // self.cell_size), self.cols - 1)
+        if row_start > row_end or col_start > col_end:
+            return np.empty(0, dtype=np.int64)
+        ranges = [np.arange(self.cells[row * self.cols + col_start], self.cells[row * self.cols + col_end + 1])
+                  for row in range(row_start, row_end + 1)]
+        return np.concatenate(ranges)
+
+    def within(self, lat, lon, radius, category=None):
+        """Return the places within `radius` meters, nearest first.
+
+        Args:
+            - lat (float), lon (float): The query point.
+            - radius (float): The search radius in meters.
+            - category (str or None): "restaurant", "hotel", or None for all categories.
+
+        Returns:
+            - list of tuple[float, list]: (distance in meters, [name, lat, lon, address]) pairs.
+        """
+        index = self._candidates(lat, lon, radius)
+        if category is not None:
+            index = index[self.categories[index] == self.category_codes[category]]
+        if not len(index):
+            return []
+        points = np.radians(self.coords[index])
+        lat0, lon0 = math.radians(lat), math.radians(lon)
+        a = np.sin((points[:, 0] - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(points[:, 0]) * np.sin((points[:, 1] - lon0) / 2) ** 2
+        distances = 2 * 6371000 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+        mask = distances <= radius
+        index, distances = index[mask], distances[mask]
+        order = np.argsort(distances, kind="stable")
+        return [(float(distances[i]), self.place(int(index[i]))) for i in order]
+
+    def nearest(self, lat, lon, k=1, category=None, max_radius=50000):
+        """Return the `k` nearest places within `max_radius` meters, nearest first (same format as `within`)."""
+        radius = self.cell_size * 111320
+        while True:
+            found = self.within(lat, lon, min(radius, max_radius), category)
+            # 半徑內已有 k 個地點時，第 k 近的地點一定在半徑內
+            if len(found) >= k or radius >= max_radius:
+                return found[:k]
+            radius *= 2
+
+    def place(self, i):
+        lat, lon = self.coords[i]
+        return [self.names[i], float(lat), float(lon), self.addresses[i]]
+
+
+@lru_cache(maxsize=4)
+def load_poi_index(prefix):
+    """Load (once per prefix) the POI index, or return None if it has not been built or numpy is missing."""
+    if np is None:
+        return None
+    try:
+        return POIIndex(prefix)
+    except FileNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    # python poi_index.py taiwan_poi_export.json taiwan_poi
+    count = build_poi_index(sys.argv[1], sys.argv[2])
+    print(f"已建立 {count} 個地點的索引：{sys.argv[2]}")
@@ -0,0 +1,239 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+# Set TRIP_TRACE=1 to trace from the start, or call `enable()`.
+enabled = os.environ.get("TRIP_TRACE", "") not in ("", "0")
+
+current_span = contextvars.ContextVar("current_span", default=None)
+lock = threading.Lock()
+root_spans = []
+totals = dict()
+
+
+class Span:
+    """A timed stage of the planning pipeline, with its attributes, counters and child spans.
+
+    Counters recorded in a span are added to its parent when it ends, so each span reports the totals of its subtree.
+    """
+
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent", "start_ns", "end_ns", "error", "counters", "children")
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.counters = dict()
+        self.children = []
+
+    def to_dict(self):
+        """Return the span and its children as nested dictionaries."""
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "name": self.name,
+            "duration_ms": (end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "counters": format_counters(self.counters),
+            "error": self.error,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class _NoopSpan:
+    # returned while tracing is disabled, so `with span(...)` costs almost nothing
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _SpanContext:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.span = Span(self.name, current_span.get(), self.attributes)
+        self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        span = self.span
+        current_span.reset(self.token)
+        span.end_ns = time.time_ns()
+        if exc_type is not None:
+            span.error = f"{exc_type.__name__}: {exc_value}"
+        with lock:
+            if span.parent is not None:
+                span.parent.children.append(span)
+                merge_counters(span.parent.counters, span.counters)
+            else:
+                root_spans.append(span)
+        return False
+
+
+def enable():
+    """Start recording spans and counters."""
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Stop recording spans and counters; recorded data is kept until `reset`."""
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Drop every recorded span and counter."""
+    with lock:
+        root_spans.clear()
+        totals.clear()
+
+
+def span(name, **attributes):
+    """Return a context manager timing a stage as a span nested in the current one.
+
+    Args:
+        - name (str): The span name.
+        - **attributes: Attributes recorded on the span.
+    """
+    if not enabled:
+        return NOOP_SPAN
+    return _SpanContext(name, attributes)
+
+
+def traced(name=None):
+    """Decorator recording every call of the function as a span named `name` (default: the function name)."""
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _SpanContext(span_name, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(function):
+    """Bind a function to the current span, so spans it opens in a worker thread nest under the caller's span."""
+    if not enabled:
+        return function
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(function, *args, **kwargs)
+
+
+def count(name, value=1, provider=None):
+    """Add `value` to a counter, e.g. `count("http.requests", provider="google")` or `count("http.bytes", 512, "here")`.
+
+    The counter is recorded in the totals and in the current span.
+    """
+    if not enabled:
+        return
+    key = (name, provider)
+    parent = current_span.get()
+    with lock:
+        totals[key] = totals.get(key, 0) + value
+        if parent is not None:
+            parent.counters[key] = parent.counters.get(key, 0) + value
+
+
+def merge_counters(target, counters):
+    for key, value in counters.items():
+        target[key] = target.get(key, 0) + value
+
+
+def format_counters(counters):
+    """Return counters as {name: {provider: value}}, with "all" as the provider of counters without one."""
+    result = dict()
+    for (name, provider), value in sorted(counters.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        result.setdefault(name, {})[provider if provider is not None else "all"] = value
+    return result
+
+
+def counters():
+    """Return the counter totals, see `format_counters`."""
+    with lock:
+        return format_counters(totals)
+
+
+def export_json(path=None):
+    """Export the recorded spans as a tree together with the counter totals.
+
+    Args:
+        - path (str or None): Also write the trace to this JSON file.
+
+    Returns:
+        - dict: {"spans": [nested span dictionaries], "counters": {name: {provider: value}}}.
+    """
+    with lock:
+        trace = {"spans": [root.to_dict() for root in root_spans], "counters": format_counters(totals)}
+    if path is not None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(trace, file, ensure_ascii=False, indent=2)
+    return trace
+
+
+def otel_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def export_otel(path=None, service_name="trip-planner"):
+    """Export the recorded spans as OpenTelemetry (OTLP/JSON) records; counters become `counter.*` span attributes.
+
+    Args:
+        - path (str or None): Also write the records to this JSON file.
+        - service_name (str): The `service.name` resource attribute.
+
+    Returns:
+        - dict: The OTLP/JSON `resourceSpans` document.
+    """
+    records = []
+    with lock:
+        pending = list(root_spans)
+        while pending:
+            span = pending.pop()
+            pending.extend(span.children)
+            attributes = dict(span.attributes)
+            for (name, provider), value in span.counters.items():
+                attributes[f"counter.{name}" + (f".{provider}" if provider is not None else "")] = value
+            records.append({
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent.span_id if span.parent is not None else "",
+                "name": span.name,
+                "kind": "SPAN_KIND_INTERNAL",
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": otel_value(value)} for key, value in attributes.items()],
+                "status": {"code": "STATUS_CODE_ERROR", "message": span.error} if span.error else {"code": "STATUS_CODE_OK"},
+            })
+    document = {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": sorted(records, key=lambda record: int(record["startTimeUnixNano"]))}],
+    }]}
+    if path is not None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(document, file, ensure_ascii=False)
+    return document
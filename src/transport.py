@@ -0,0 +1,276 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from ratelimit import TokenBucket
+import tracing
+
+# Timeouts in seconds: connecting to the host, and waiting for the response between bytes.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# Retries after a connection error, a timeout or a retryable status, with full-jitter exponential backoff.
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 8.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Keep-alive connections kept per host.
+POOL_MAXSIZE = 16
+
+# The provider of each host, sharing one rate limit per provider.
+PROVIDER_HOSTS = {
+    "maps.googleapis.com": "google",
+    "router.hereapi.com": "here",
+    "matrix.router.hereapi.com": "here",
+    "overpass-api.de": "overpass",
+}
+
+# Query parameters holding API keys, left out of fixture keys and recorded URLs.
+SECRET_PARAMS = frozenset({"key", "apiKey", "api_key"})
+
+# Rate limit of each provider: (requests per second, burst size).
+PROVIDER_LIMITS = {
+    "google": (40, 10),
+    "here": (10, 10),
+    "overpass": (1, 2),
+}
+
+
+class Transport:
+    """Shared HTTP transport with per-host keep-alive sessions, timeouts, retries and per-provider rate limits.
+
+    Requests raise the same `requests.exceptions.RequestException` subclasses as `requests.get`, and a response
+    with an error status is returned as-is once the retries are used up, so callers keep their error handling.
+
+    Args:
+        - connect_timeout (float), read_timeout (float): The default timeouts in seconds.
+        - max_retries (int): The default number of retries per request.
+        - backoff (float): The base backoff delay in seconds, doubled on each retry.
+        - backoff_max (float): The maximum backoff delay in seconds.
+        - pool_maxsize (int): The number of keep-alive connections per host.
+        - limits (dict): {provider: (rate, capacity)} token bucket settings.
+        - hosts (dict): {host: provider}; other hosts are their own provider without a rate limit.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff=RETRY_BACKOFF, backoff_max=RETRY_BACKOFF_MAX, pool_maxsize=POOL_MAXSIZE,
+                 limits=PROVIDER_LIMITS, hosts=PROVIDER_HOSTS):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.pool_maxsize = pool_maxsize
+        self.hosts = dict(hosts)
+        self.limiters = {provider: TokenBucket(rate=rate, capacity=capacity) for provider, (rate, capacity) in limits.items()}
+        self.sessions = dict()
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    def session(self, host):
+        """Return the keep-alive session of a host, creating it on first use."""
+        with self._lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                # retries are handled by `request`, so that they are throttled and counted
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.sessions[host] = session
+            return session
+
+    def provider(self, url):
+        """Return the provider name of a URL."""
+        host = urlsplit(url).hostname or ""
+        return self.hosts.get(host, host)
+
+    def _record(self, provider, **counts):
+        for name in ("requests", "retries", "errors", "bytes"):
+            if counts.get(name):
+                tracing.count(f"http.{name}", counts[name], provider)
+        with self._lock:
+            stats = self._stats.setdefault(provider, {
+                "requests": 0, "retries": 0, "errors": 0, "bytes": 0, "seconds": 0.0, "throttled_seconds": 0.0,
+            })
+            for name, value in counts.items():
+                stats[name] += value
+
+    def _delay(self, attempt, response=None):
+        # honor Retry-After in seconds, otherwise full jitter: uniform(0, min(max, base * 2^attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, timeout=None, retries=None, **kwargs):
+        """Send an HTTP request through the shared session of its host.
+
+        Args:
+            - method (str): The HTTP method.
+            - url (str): The URL.
+            - timeout (float or tuple or None): The timeout, or (connect, read) timeouts; defaults to the transport's.
+            - retries (int or None): The number of retries; defaults to the transport's.
+            - **kwargs: Passed to `requests.Session.request`, e.g. `params` or `json`.
+
+        Returns:
+            - requests.Response: The response.
+        """
+        provider = self.provider(url)
+        session = self.session(urlsplit(url).hostname or "")
+        limiter = self.limiters.get(provider)
+        retries = self.max_retries if retries is None else retries
+
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                self._record(provider, throttled_seconds=limiter.acquire())
+            started = time.monotonic()
+            try:
+                response = self.send(session, method, url, timeout=timeout or self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._record(provider, requests=1, errors=1, seconds=time.monotonic() - started)
+                if attempt == retries:
+                    raise
+                response = None
+            else:
+                self._record(provider, requests=1, bytes=len(response.content), seconds=time.monotonic() - started,
+                             errors=int(response.status_code >= 400))
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    return response
+            self._record(provider, retries=1)
+            time.sleep(self._delay(attempt, response))
+
+    def send(self, session, method, url, **kwargs):
+        """Send one attempt of a request; overridden by `FixtureTransport`."""
+        return session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """Send a GET request, see `request`."""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Send a POST request, see `request`."""
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """Return request and throttling statistics per provider, and the open sessions.
+
+        Returns:
+            - dict: {"providers": {provider: {"requests", "retries", "errors", "bytes", "seconds", "throttled_seconds"}},
+              "sessions": [host, ...]}.
+        """
+        with self._lock:
+            return {
+                "providers": {provider: dict(stats) for provider, stats in self._stats.items()},
+                "sessions": sorted(self.sessions),
+            }
+
+    def close(self):
+        """Close every session and its connections."""
+        with self._lock:
+            sessions, self.sessions = list(self.sessions.values()), dict()
+        for session in sessions:
+            session.close()
+
+
+class FixtureMissing(requests.exceptions.RequestException):
+    """Raised when a replayed request has no recorded response."""
+
+
+def fixture_key(method, url, params=None, body=None):
+    """Return the key of a request in the fixtures, ignoring API keys and parameter order."""
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query) if name not in SECRET_PARAMS]
+    query += [(name, str(value)) for name, value in (params or {}).items() if name not in SECRET_PARAMS]
+    content = json.dumps([method.upper(), f"{parts.scheme}://{parts.netloc}{parts.path}", sorted(query), body],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+class FixtureTransport(Transport):
+    """Transport recording responses as fixtures, or replaying them without network access.
+
+    Throttling, retries and statistics work as in `Transport`, so a replayed run issues the same requests.
+
+    Args:
+        - fixtures (dict): {fixture key: recorded response}, filled in "record" mode and read in "replay" mode.
+        - mode (str): "record" sends real requests and stores their responses; "replay" only answers from `fixtures`.
+        - latency (float): Seconds added to every replayed response, to simulate the network.
+        - fallback (function or None): Called as fallback(method, url, params, body) -> (status, JSON content)
+            for requests missing from `fixtures` in "replay" mode; None raises `FixtureMissing` instead.
+        - **settings: Passed to `Transport`.
+    """
+
+    def __init__(self, fixtures, mode="replay", latency=0.0, fallback=None, **settings):
+        super().__init__(**settings)
+        self.fixtures = fixtures
+        self.mode = mode
+        self.latency = latency
+        self.fallback = fallback
+        self.misses = 0
+
+    def send(self, session, method, url, **kwargs):
+        params = kwargs.get("params")
+        body = kwargs.get("json", kwargs.get("data"))
+        key = fixture_key(method, url, params, body)
+        if self.mode == "record":
+            response = super().send(session, method, url, **kwargs)
+            with self._lock:
+                self.fixtures[key] = {
+                    "method": method.upper(),
+                    "url": urlsplit(url)._replace(query="").geturl(),
+                    "request": body,
+                    "status": response.status_code,
+                    "content_type": response.headers.get("Content-Type", ""),
+                    "body": response.content.decode("utf-8", "replace"),
+                }
+            return response
+
+        if self.latency:
+            time.sleep(self.latency)
+        entry = self.fixtures.get(key)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            if self.fallback is None:
+                raise FixtureMissing(f"No recorded response for {method.upper()} {urlsplit(url).path}")
+            status, content = self.fallback(method.upper(), url, params, body)
+            entry = {"status": status, "content_type": "application/json", "body": json.dumps(content, ensure_ascii=False)}
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers["Content-Type"] = entry["content_type"]
+        response._content = entry["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = url
+        return response
+
+
+# The transport shared by all modules.
+default_transport = Transport()
+
+
+def set_default_transport(transport):
+    """Replace the shared transport, e.g. with a `FixtureTransport`, and return the previous one."""
+    global default_transport
+    previous, default_transport = default_transport, transport
+    return previous
+
+
+def get(url, **kwargs):
+    """Send a GET request through the shared transport, see `Transport.request`."""
+    return default_transport.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    """Send a POST request through the shared transport, see `Transport.request`."""
+    return default_transport.post(url, **kwargs)
+
+
+def transport_stats():
+    """Return the statistics of the shared transport, see `Transport.stats`."""
+    return default_transport.stats()